@@ -0,0 +1,245 @@
+# WinDJ - David Ragusa
+# Refer to the LICENSE file.
+
+import os
+import vlc
+import time
+import queue
+import logging
+import sqlite3
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from mixer import decoded, RATE, CHANNELS, np
+
+STEP = RATE // 10  # frames, loudness is measured over 400 ms blocks every 100 ms
+SEGMENT = 2 ** 16  # frames filtered at a time
+ABSOLUTE_GATE = -70.0  # lufs
+RELATIVE_GATE = -10.0  # lu below the loudness of the blocks above the absolute gate
+MAX_GAIN = 12.0  # db either way, so a near silent file isn't turned up to full volume
+LEAD = 10  # s at the start and end of a song searched for silence
+SILENCE = 32768 * 10 ** (-50 / 20)  # sample level of -50 dBFS, anything quieter is silence
+MARGIN = 0.01  # s of silence kept next to the sound, so its attack isn't cut off
+
+# the k-weighting filter of bs.1770 at 48 kHz, a high shelf then a high pass, as (b, a) biquad coefficients
+SHELF = ((1.53512485958697, -2.69169618940638, 1.19839281085285), (1.0, -1.69065929318241, 0.73248077421585))
+HIGHPASS = ((1.0, -2.0, 1.0), (1.0, -1.99004745483398, 0.99007225036621))
+
+log = logging.getLogger('windj')
+
+# per worker process
+instance = None
+idle = None
+stop = None
+fir = None  # the k-weighting filter, made the first time it's needed
+
+
+def k_weighting(taps=4096):
+    # the filter's impulse response, which has died away long before taps, for filtering by fft
+    z = np.exp(-1j * np.linspace(0, np.pi, 2 ** 15 + 1))  # z^-1 around the unit circle
+    response = 1
+    for b, a in (SHELF, HIGHPASS):
+        response = response * (b[0] + b[1] * z + b[2] * z ** 2) / (a[0] + a[1] * z + a[2] * z ** 2)
+    return np.fft.irfft(response)[:taps]
+
+
+def step_energies(file, fir):
+    # the k-weighted energy, summed over channels, of each 100 ms of a wav file from transcode
+    # filtered a segment at a time by overlap-add, so a whole song is never in memory at once
+    hop = SEGMENT - len(fir) + 1
+    response = np.fft.rfft(fir, SEGMENT)[:, None]
+    carry = np.zeros((len(fir) - 1, CHANNELS))  # the tail of the last segment's filtering
+    rest = np.zeros(0)  # energies of frames not yet making up a whole step
+    steps = []
+    while True:
+        data = file.readframes(hop)
+        if not data:
+            break
+        pcm = np.frombuffer(data, np.int16).reshape(-1, CHANNELS) / 32768
+        filtered = np.fft.irfft(np.fft.rfft(pcm, SEGMENT, axis=0) * response, SEGMENT, axis=0)
+        filtered[:len(carry)] += carry
+        carry = filtered[len(pcm):len(pcm) + len(carry)]
+        energies = np.concatenate([rest, (filtered[:len(pcm)] ** 2).sum(axis=1)])
+        whole = len(energies) // STEP * STEP
+        steps.append(energies[:whole].reshape(-1, STEP).sum(axis=1))
+        rest = energies[whole:]
+    return np.concatenate(steps) if steps else np.zeros(0)
+
+
+def integrated_loudness(steps):
+    # in lufs as bs.1770 gates it, None if it's silent throughout
+    blocks = np.convolve(steps, np.ones(4), 'valid') / (4 * STEP)
+    blocks = blocks[blocks > 10 ** ((ABSOLUTE_GATE + 0.691) / 10)]
+    if not len(blocks):
+        return None
+    gate = -0.691 + 10 * np.log10(blocks.mean()) + RELATIVE_GATE
+    blocks = blocks[blocks > 10 ** ((gate + 0.691) / 10)]
+    return float(-0.691 + 10 * np.log10(blocks.mean()))
+
+
+def measure_loudness(path):
+    # (lufs,) of a whole song
+    global fir
+    if fir is None:
+        fir = k_weighting()
+    with decoded(instance, path, idle=idle, stop=stop, timeout=300) as file:
+        if file is None:
+            return None
+        return (integrated_loudness(step_energies(file, fir)),)
+
+
+def read_pcm(file):
+    return np.frombuffer(file.readframes(file.getnframes()), np.int16).reshape(-1, CHANNELS)
+
+
+def first_sound(pcm):
+    # the first frame with a sample louder than silence, None if there isn't one
+    # looked for 100 ms at a time, as the sound usually starts well before the end
+    for begin in range(0, len(pcm), STEP):
+        chunk = pcm[begin:begin + STEP]
+        loud = ((chunk > SILENCE) | (chunk < -SILENCE)).any(axis=1)  # abs() of int16 overflows at -32768
+        if loud.any():
+            return begin + int(loud.argmax())
+    return None
+
+
+def song_length(path):
+    # s, None if vlc can't tell
+    media = instance.media_new(path)
+    parsed = threading.Event()
+    media.event_manager().event_attach(vlc.EventType.MediaParsedChanged, lambda _: parsed.set())
+    media.parse_with_options(vlc.MediaParseFlag.local, 5000)
+    parsed.wait(6)
+    duration = media.get_duration()
+    media.release()
+    return duration / 1000 if duration > 0 else None
+
+
+def measure_silence(path):
+    # (start, end) in ms of the sound in a song, only decoding its first and last few seconds
+    # end is None if the length of the song isn't known. where there's no sound within LEAD of the start or end,
+    # e.g. a long quiet intro, that end isn't trimmed: start is 0 and end is None
+    with decoded(instance, path, idle=idle, stop=stop, options=(f':stop-time={LEAD}',)) as file:
+        if file is None:
+            return None
+        sound = first_sound(read_pcm(file))
+    start = max(0.0, sound / RATE - MARGIN) if sound is not None else 0.0
+    end = None
+    length = song_length(path)
+    if length:
+        tail_start = max(0.0, length - LEAD)
+        with decoded(instance, path, idle=idle, stop=stop, options=(f':start-time={tail_start:.3f}',)) as file:
+            if file:
+                tail = read_pcm(file)[::-1]
+                sound = first_sound(tail)
+                if sound is not None:
+                    end = tail_start + (len(tail) - sound) / RATE + MARGIN
+    return start * 1000, end * 1000 if end and end > start else None
+
+
+def loudness_gain(lufs, target):
+    # the volume factor that brings a song measured at lufs to target
+    return 10 ** (max(-MAX_GAIN, min(MAX_GAIN, target - lufs)) / 20)
+
+
+def start_worker(idle_event, stop_event):
+    global instance, idle, stop
+    instance = vlc.Instance('--no-video', '--quiet')
+    idle = idle_event
+    stop = stop_event
+
+
+class Analyser(threading.Thread):
+    # measures library files on a process pool in the background, caching the results on disk by path+mtime
+    # measure runs in the workers and returns a value per column for a path, or None if it can't be measured
+    # files already measured are skipped, so it picks up where it left off if WinDJ was closed halfway through
+    # nothing new is started while something is playing, and decoding already started pauses as well
+    # close() abandons whatever is queued or decoding, so quitting never waits on a song being measured
+
+    def __init__(self, db_path, table, columns, measure, workers=1):
+        super().__init__(daemon=True)
+        self.db_path = db_path
+        self.table = table
+        self.columns = columns
+        self.measure = measure
+        self.workers = workers
+        self.paths = queue.Queue()
+        self.idle = multiprocessing.Event()
+        self.idle.set()
+        self.stopped = multiprocessing.Event()
+        self.pool = None
+
+        db = sqlite3.connect(db_path)
+        db.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                path TEXT PRIMARY KEY, mtime INTEGER, {', '.join(f'{column} REAL' for column in columns)}
+            )
+        ''')
+        self.results = {row[0]: (row[1], row[2:]) for row in db.execute(f'SELECT * FROM {table}')}
+        db.close()
+
+    def submit(self, paths):
+        self.paths.put(list(paths))
+
+    def pause(self):
+        self.idle.clear()
+
+    def resume(self):
+        self.idle.set()
+
+    def close(self):
+        self.stopped.set()
+        self.idle.set()
+        if self.pool:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+
+    def get(self, path):
+        # the measured values, None if not measured (yet)
+        result = self.results.get(path)
+        return result[1] if result and result[1][0] is not None else None
+
+    def store(self, db, futures):
+        with db:
+            for future in futures:
+                if future.cancelled() or future.exception() or self.stopped.is_set():
+                    continue  # tried again next time, anything measured after close() may have been cut short
+                path, mtime = futures[future]
+                values = future.result() or (None,) * len(self.columns)
+                db.execute(f'INSERT OR REPLACE INTO {self.table} VALUES (?, ?{", ?" * len(values)})',
+                           (path, mtime, *values))
+                self.results[path] = (mtime, values)
+
+    def run(self):
+        db = sqlite3.connect(self.db_path)
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, initializer=start_worker,
+                                        initargs=(self.idle, self.stopped))
+        while True:
+            pending = {}
+            paths = self.paths.get()
+            began = time.perf_counter()
+            measured = 0
+            for path in paths:
+                self.idle.wait()
+                if self.stopped.is_set():
+                    return
+                try:
+                    mtime = os.stat(path).st_mtime_ns
+                except OSError:
+                    continue
+                cached = self.results.get(path)
+                if cached and cached[0] == mtime:
+                    continue
+                try:
+                    pending[self.pool.submit(self.measure, path)] = (path, mtime)
+                except RuntimeError:
+                    return  # closed meanwhile
+                measured += 1
+                if len(pending) >= self.workers * 2:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    self.store(db, {future: pending.pop(future) for future in done})
+            self.store(db, pending)
+            if measured:
+                # includes any time spent paused
+                elapsed = time.perf_counter() - began
+                log.info('%s: measured %d files in %.1fs, %.1f files/s', self.table, measured, elapsed,
+                         measured / elapsed)
@@ -0,0 +1,157 @@
+# WinDJ - David Ragusa
+# Refer to the LICENSE file.
+
+# soak benchmark of play/stop cycles through WinDJ's own play() and stop(), against a stub player
+# checks the session keeps one vlc instance and player, and that the python heap and start latency stay flat
+# run from this folder (it reads config.cfg):  python bench_playback.py [cycles]
+
+import gc
+import sys
+import time
+import types
+import tracemalloc
+import stub_vlc
+
+sys.modules['vlc'] = stub_vlc
+for name in ('pyWinhook',):
+    # windows only, not used on this path
+    try:
+        __import__(name)
+    except ImportError:
+        sys.modules[name] = types.ModuleType(name)
+
+import dj  # noqa: E402
+from instrument import LatencyStats  # noqa: E402
+
+
+class Root:
+    # the bits of tk's root window WinDJ calls while playing and stopping. callbacks run when run() is called
+
+    def __init__(self):
+        self.callbacks = {}
+        self.next_id = 0
+
+    def after(self, ms, callback, *args):
+        self.next_id += 1
+        self.callbacks[self.next_id] = (callback, args)
+        return self.next_id
+
+    def after_cancel(self, callback_id):
+        self.callbacks.pop(callback_id, None)
+
+    def run(self):
+        callbacks, self.callbacks = self.callbacks, {}
+        for callback, args in callbacks.values():
+            callback(*args)
+
+    def withdraw(self):
+        pass
+
+    def deiconify(self):
+        pass
+
+    def update(self):
+        pass
+
+
+class Var:
+
+    def set(self, value):
+        self.value = value
+
+
+def headless(songs):
+    # a WinDJ with what play() and stop() use set up as __init__ would, without tk or the library
+    dj.Settings.update(prebuffer=False, crossfade=0, output_device=None, hide_on_play=True, show_on_stop=True)
+    app = object.__new__(dj.WinDJ)
+    app.root = Root()
+    app.is_visible = True
+    app.state = 'stopped'
+    app.is_searching = False
+    app.saved_volume = 30
+    app.playing_name = ''
+    app.playing_path = None
+    app.playing_entry = None
+    app.queue = dj.PlayQueue()
+    app.end_callback = None
+    app.player_callback = None
+    app.position = app.length = 0
+    app.timer_text = None
+    app.latency = dj.StageRecorder(('hook', 'dispatch', 'play', 'player_play', 'playing'))
+    app.pressed = None
+    app.metadata = app.loudness = app.silence = None
+    app.analysers = []
+    app.gain = 1.0
+    app.end_at = None
+    app.instance = stub_vlc.Instance('--no-video')
+    app.player_events = dj.PlayerEvents(playing=lambda: app.latency.mark('playing'))
+    app.controller = dj.PlayController(app.play, app.stop, lambda: app.is_playing)
+    app.routed = True
+    app.start_callback = None
+    app.adopt_player(app.instance.media_player_new())
+    app.player_volume = None
+    app.prebuffer = dj.Prebuffer(app.instance, 2)
+    app.prebuffer_callback = None
+    app.fader = app.spare = None
+    app.mixer = app.soundboard = None
+    app.song_list = songs
+    app.listbox = types.SimpleNamespace(selection=0)
+    app.songname_var, app.timer_var, app.status_var = Var(), Var(), Var()
+    return app
+
+
+def cycle(app, index):
+    # s the press that starts the song took, through play() to the player's play()
+    app.listbox.selection = index
+    began = time.perf_counter()
+    app.controller.toggle()
+    started = time.perf_counter() - began
+    app.p.event_manager().fire(stub_vlc.EventType.MediaPlayerPlaying)
+    app.root.run()  # wait_for_start sees it settle
+    app.controller.toggle()
+    app.root.run()
+    return started
+
+
+def heap_size():
+    # bytes allocated since tracing started, leaving out the benchmark's own bookkeeping
+    # and garbage that is only waiting for the collector
+    gc.collect()
+    snapshot = tracemalloc.take_snapshot().filter_traces((tracemalloc.Filter(False, __file__),
+                                                          tracemalloc.Filter(False, tracemalloc.__file__)))
+    return sum(stat.size for stat in snapshot.statistics('filename'))
+
+
+def main(cycles=5000):
+    songs = [{'index': index, 'path': 'C:\\Music', 'filename': f'{index:04d}.mp3', 'display': f'Song {index}'}
+             for index in range(100)]
+    app = headless(songs)
+    for index in range(200):  # warm up caches and histograms
+        cycle(app, index % len(songs))
+    tracemalloc.start()
+    heap = []
+    latencies = [0.0] * cycles  # filled in place, so nothing the benchmark keeps shows up in the heap
+    began = time.perf_counter()
+    for index in range(cycles):
+        latencies[index] = cycle(app, index % len(songs))
+        if index % 500 == 499:
+            heap.append(heap_size())
+    elapsed = time.perf_counter() - began
+    tracemalloc.stop()
+    windows = []  # start latency of each 500 cycles
+    for start in range(0, cycles, 500):
+        windows.append(LatencyStats())
+        for latency in latencies[start:start + 500]:
+            windows[-1].add(latency)
+
+    print(f'{cycles} play/stop cycles in {elapsed:.2f}s, {elapsed / cycles * 1e6:.0f} us per cycle (traced, '
+          f'with heap snapshots)')
+    print(f'vlc instances made: {stub_vlc.Instance.made}, players made: {stub_vlc.MediaPlayer.made}')
+    print('python heap every 500 cycles (KB): ' + ' '.join(f'{size / 1024:.1f}' for size in heap))
+    print('start latency every 500 cycles (us, p50/p99):')
+    print(' '.join(f'{p[50] * 1e6:.0f}/{p[99] * 1e6:.0f}' for p in (window.percentiles(50, 99) for window in windows)))
+    print(f'player plays: {app.p.plays}, playing now: {app.p.playing}, media left set: {app.p.media is not None}')
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,71 @@
+# WinDJ - David Ragusa
+# Refer to the LICENSE file.
+
+# benchmark of library search over random song names: the original search, the scan and the trigram index
+# run with the library sizes to try:  python bench_search.py [songs ...], 10000, 100000 and 1000000 by default
+
+import sys
+import time
+import random
+import string
+from library import SongList
+
+SIZES = (10000, 100000, 1000000)
+
+
+def names(count, seed=0):
+    # four random words of 2 to 8 letters per song
+    rng = random.Random(seed)
+    return [' '.join(''.join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 8))) for _ in range(4))
+            for _ in range(count)]
+
+
+def song_list(count):
+    songs = SongList()
+    folder_id = songs.folder_id('C:\\Music', (0, ()))
+    for name in names(count):
+        songs.append(folder_id, name + '.mp3', name)
+    return songs
+
+
+def song_dicts(count):
+    # the song list as search_songlist searched it originally, a dict per song
+    return [{'index': index, 'path': 'C:\\Music', 'filename': name + '.mp3', 'display': name}
+            for index, name in enumerate(names(count))]
+
+
+def original_search(song_list, text):
+    # search_songlist before the library was kept as arrays, lowercasing every name on every keystroke
+    return [entry for entry in song_list if text in entry['display'].lower()]
+
+
+def timed(search, repeat=5):
+    # best of repeat, in ms
+    best = None
+    for _ in range(repeat):
+        began = time.perf_counter()
+        search()
+        elapsed = (time.perf_counter() - began) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(sizes=SIZES):
+    print('songs   query      original     scan     index    (ms, best of 5)')
+    for size in sizes:
+        songs = song_list(size)
+        dicts = song_dicts(size)
+        queries = ('a', 'ab', songs.search_keys[size // 2][:5])
+        scans = [timed(lambda: songs.search(query)) for query in queries]
+        began = time.perf_counter()
+        songs.build_index()
+        build = time.perf_counter() - began
+        for query, scan in zip(queries, scans):
+            assert list(songs.search(query).indices) == [entry['index'] for entry in original_search(dicts, query)]
+            print(f'{size:<7} {query!r:<10} {timed(lambda: original_search(dicts, query)):<12.1f} {scan:<8.1f} '
+                  f'{timed(lambda: songs.search(query)):.1f}')
+        print(f'{size:<7} index built in {build:.2f}s')
+
+
+if __name__ == '__main__':
+    main(tuple(map(int, sys.argv[1:])) or SIZES)
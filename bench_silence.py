@@ -0,0 +1,87 @@
+# WinDJ - David Ragusa
+# Refer to the LICENSE file.
+
+# benchmark of the silence analysis in files/s, as the Analyser's workers run measure_silence
+# run with song files to measure them for real, decoded by vlc:  python bench_silence.py [files ...]
+# without any it times the search on synthetic songs, their windows read from wav files written beforehand
+# in place of vlc's transcode, so it runs without libvlc
+
+import os
+import sys
+import time
+import wave
+import tempfile
+import threading
+import stub_vlc
+from contextlib import contextmanager
+
+if len(sys.argv) == 1:
+    sys.modules['vlc'] = stub_vlc
+
+import analysis  # noqa: E402
+from mixer import RATE, CHANNELS, np  # noqa: E402
+
+SONGS = 200
+LENGTH = 240  # s
+
+
+def write_wav(path, pcm):
+    with wave.open(path, 'wb') as file:
+        file.setnchannels(CHANNELS)
+        file.setsampwidth(2)
+        file.setframerate(RATE)
+        file.writeframes(pcm.tobytes())
+
+
+def synthetic(folder, count, seed=0):
+    # {song: (wav of its first LEAD s, wav of its last LEAD s)}, each with up to 3 s of silence before and after
+    # a noisy middle. only the two windows are written, as that's all measure_silence decodes
+    rng = np.random.default_rng(seed)
+    lead = analysis.LEAD * RATE
+    songs = {}
+    for index in range(count):
+        head = np.zeros((lead, CHANNELS), np.int16)
+        tail = np.zeros((lead, CHANNELS), np.int16)
+        intro, outro = rng.integers(0, 3 * RATE, 2)
+        head[intro:] = rng.integers(-8000, 8000, (lead - intro, CHANNELS))
+        tail[:lead - outro] = rng.integers(-8000, 8000, (lead - outro, CHANNELS))
+        name = f'{index:04d}.mp3'
+        songs[name] = (os.path.join(folder, f'{index:04d}.head.wav'), os.path.join(folder, f'{index:04d}.tail.wav'))
+        write_wav(songs[name][0], head)
+        write_wav(songs[name][1], tail)
+    return songs
+
+
+def measure(paths):
+    # (files/s, how many of them could be measured)
+    began = time.perf_counter()
+    measured = sum(analysis.measure_silence(path) is not None for path in paths)
+    return len(paths) / (time.perf_counter() - began), measured
+
+
+def main(paths):
+    idle, stop = threading.Event(), threading.Event()
+    idle.set()
+    if paths:
+        analysis.start_worker(idle, stop)
+        rate, measured = measure(paths)
+        print(f'{len(paths)} files ({measured} measured) decoded by vlc: {rate:.1f} files/s')
+        return
+    with tempfile.TemporaryDirectory() as folder:
+        songs = synthetic(folder, SONGS)
+
+        @contextmanager
+        def decoded(instance, path, options=(), **kwargs):
+            with wave.open(songs[path][options[0].startswith(':start-time')]) as file:
+                yield file
+
+        analysis.decoded = decoded
+        analysis.song_length = lambda path: LENGTH
+        analysis.start_worker(idle, stop)
+        rate, measured = measure(list(songs))
+        print(f'{SONGS} synthetic songs ({measured} measured), two {analysis.LEAD} s windows each read from wav: '
+              f'{rate:.0f} files/s')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -4,22 +4,35 @@
 import os
 import re
 import sys
-import pafy
+import time
 import html
-import queue
-import requests
+import logging
 import threading
 import pyWinhook
 import tkinter as tk
 import multiprocessing
 from configparser import ConfigParser
-from helper import errorbox, resource_path
+from helper import errorbox, resource_path, data_path, KeyChannel
 
+# before the modules that use vlc, so a missing libvlc gets the error box rather than a traceback
 try:
     import vlc
 except (ImportError, OSError):
     errorbox('VLC is not installed.')
 
+from library import Library, SongView
+from watcher import FolderWatcher
+from metadata import MetadataPipeline
+from search import SearchWorker, normalize, narrows
+from keymap import Keymap, Modifiers, SHIFT
+from instrument import StageRecorder, process_age
+from prebuffer import Prebuffer
+from playback import PlayerEvents, PlayController, PlayQueue, Fader
+from widgets import VirtualList
+from snapshot import SnapshotWriter, open_latest, unchanged
+
+log = logging.getLogger('windj')
+
 
 class AttrDict(dict):
     # access data by dot notation e.g. {'a': 1} -> d.a = 1
@@ -62,6 +75,12 @@ def get_setting_from_config(name, type_, default):
                 errorbox(f'Invalid number for {name}:\n{setting}')
         elif type_ is str:
             return setting
+        elif isinstance(type_, tuple):
+            # one of a fixed set of choices
+            if setting.lower() in type_:
+                return setting.lower()
+            else:
+                errorbox(f'Invalid setting for {name}:\n{setting}\nShould be one of: {", ".join(type_)}')
     else:
         return default
 
@@ -73,6 +92,17 @@ def get_control_from_config(name):
         errorbox(f'Missing \'{name}\' control.')
 
 
+def get_mode_controls_from_config(section):
+    # optional section of controls that are different in one mode
+    if not config.has_section(section):
+        return {}
+    controls = dict(config.items(section))
+    for name in controls:
+        if name not in Controls:
+            errorbox(f'Unknown control \'{name}\' in [{section}].')
+    return controls
+
+
 Settings = AttrDict({
     'hide_on_play': get_setting_from_config('hide_on_play', bool, True),
     'show_on_stop': get_setting_from_config('show_on_stop', bool, True),
@@ -85,7 +115,33 @@ Settings = AttrDict({
     'controls_captured': get_setting_from_config('controls_captured', bool, False),
     'search_captured': get_setting_from_config('search_captured', bool, False),
     'toggle_play_captured': get_setting_from_config('toggle_play_captured', bool, False),
-    'output_device': get_setting_from_config('output_device', str, None)
+    'output_device': get_setting_from_config('output_device', str, None),
+    'library_file': get_setting_from_config('library_file', str, None) or data_path('library.db'),
+    'scan_depth': get_setting_from_config('scan_depth', int, None),
+    'scan_exclude': [pattern.strip() for pattern in get_setting_from_config('scan_exclude', str, '').split(',')
+                     if pattern.strip()],
+    'scan_workers': get_setting_from_config('scan_workers', int, 4),
+    'watch_folders': get_setting_from_config('watch_folders', bool, True),
+    'watch_interval': get_setting_from_config('watch_interval', int, 2),
+    'read_metadata': get_setting_from_config('read_metadata', bool, True),
+    'metadata_workers': get_setting_from_config('metadata_workers', int, 2),
+    'show_tags': get_setting_from_config('show_tags', bool, False),
+    'search_index': get_setting_from_config('search_index', bool, False),
+    'snapshot': get_setting_from_config('snapshot', bool, True),
+    'search_mode': get_setting_from_config('search_mode', ('substring', 'fuzzy'), 'substring'),
+    'search_results': get_setting_from_config('search_results', int, 200),
+    'prebuffer': get_setting_from_config('prebuffer', bool, True),
+    'prebuffer_neighbours': get_setting_from_config('prebuffer_neighbours', int, 0),
+    'prebuffer_delay': get_setting_from_config('prebuffer_delay', int, 300),
+    'crossfade': get_setting_from_config('crossfade', int, 0),
+    'mixer': get_setting_from_config('mixer', bool, False),
+    'mixer_buffer': get_setting_from_config('mixer_buffer', int, 20),
+    'soundboard_memory': get_setting_from_config('soundboard_memory', int, 64),
+    'soundboard_policy': get_setting_from_config('soundboard_policy', ('restart', 'overlap'), 'restart'),
+    'normalize': get_setting_from_config('normalize', bool, False),
+    'loudness_target': get_setting_from_config('loudness_target', int, -18),
+    'skip_silence': get_setting_from_config('skip_silence', bool, False),
+    'trim_silence': get_setting_from_config('trim_silence', bool, False)
 })
 
 Controls = AttrDict({
@@ -100,11 +156,66 @@ Controls = AttrDict({
     'nav_mult_up': get_control_from_config('nav_mult_up'),
     'nav_mult_down': get_control_from_config('nav_mult_down'),
     'search': get_control_from_config('search'),
-    'yt_mode': get_control_from_config('yt_mode')
+    'yt_mode': get_control_from_config('yt_mode'),
+    'dump_latency': config.get('Controls', 'dump_latency', fallback=''),
+    'enqueue': config.get('Controls', 'enqueue', fallback=''),
+    'play_next': config.get('Controls', 'play_next', fallback=''),
+    'repeat': config.get('Controls', 'repeat', fallback=''),
+    'shuffle': config.get('Controls', 'shuffle', fallback=''),
+    'overlay': config.get('Controls', 'overlay', fallback='')
 })
 
+
+def get_clips_from_config():
+    # [Soundboard] name: control, file
+    clips = {}
+    if config.has_section('Soundboard'):
+        for name, value in config.items('Soundboard'):
+            chord, _, path = value.partition(',')
+            if not chord.strip() or not path.strip():
+                errorbox(f'Invalid clip {name}:\n{value}\nShould be a control and a file e.g. F1, C:\\airhorn.mp3')
+            clips[name] = (chord.strip(), path.strip())
+    return clips
+
+
+Clips = get_clips_from_config()
+ClipControls = {f'clip {name}': chord for name, (chord, _) in Clips.items()}
+
+# numpy and the modules built on it are only imported when something uses them, as numpy alone slows startup
+if Settings.mixer or Clips or Settings.normalize or Settings.skip_silence or Settings.trim_silence:
+    try:
+        import numpy
+    except ImportError:
+        errorbox('The mixer, soundboard, normalize and skipping silence need NumPy installed.')
+    from mixer import Mixer, DecoderSource, WaveOutSink, RATE
+    from soundboard import Soundboard
+    from analysis import Analyser, measure_loudness, measure_silence, loudness_gain
+
+QUEUE_LEAD = 2000  # ms before the end of a song that the next one in the queue is made sure to be opened
+
+SearchControls = {**Controls, **get_mode_controls_from_config('SearchControls')}
+YouTubeControls = {**SearchControls, **get_mode_controls_from_config('YouTubeControls')}
+
+try:
+    keymap = Keymap(
+        bindings={
+            'normal': {**Controls, **ClipControls},
+            'search': {**SearchControls, **ClipControls},
+            'youtube': {**YouTubeControls, **ClipControls}
+        },
+        capture_bound={
+            'normal': Settings.controls_captured,
+            'search': Settings.controls_captured or Settings.search_captured,
+            'youtube': Settings.controls_captured or Settings.search_captured
+        },
+        capture_unbound={'normal': False, 'search': Settings.search_captured, 'youtube': Settings.search_captured},
+        pass_through=() if Settings.toggle_play_captured else ('toggle_play',)
+    )
+except ValueError as e:
+    errorbox(f'Invalid controls:\n{e}')
+
 # necessary as tk can't display chars outside of BMP
-non_bmp_map = dict.fromkeys(range(0x10000, sys.maxunicode + 1), 0xfffd)
+non_bmp = re.compile('[\U00010000-\U0010ffff]')
 
 
 class WinDJ:
@@ -113,28 +224,114 @@ class WinDJ:
         # class init
         self.root = root
         self.root.title('WinDJ')
-        self.root.bind('<<keypressed>>', self.button_press)
 
         # WinDJ init
         self.is_visible = True
-        self.is_playing = False
+        # 'playing', 'ended' or 'error' (the song finished or failed, but play hasn't been toggled off yet), 'stopped'
+        self.state = 'stopped'
         self.is_searching = False
         self.search_string = ''
+        self.search_stack = []  # (query, results) for each keystroke of the current search
+        self.search_generation = 0
+        self.search_pending = None  # generation of the search running on the worker, if any
+        self.search_polling = False
+        self.search_worker = SearchWorker()
+        self.search_worker.start()
         self.saved_volume = 30
         self.playing_name = ''
-        self.play_lock = False
+        self.playing_path = None
+        self.playing_entry = None
+        self.queue = PlayQueue()
+        self.end_callback = None
         self.youtube_mode = False
         self.youtube_thread = None
-        self.timer_callback = None
-
-        # song list
-        self.song_list = None  # will be populated line below
-        self.populate_song_list()
+        self.player_callback = None
+        self.position = 0  # ms, from the player's events
+        self.length = 0
+        self.timer_text = None
+        self.actions = {
+            'reset': self.reset,
+            'toggle_show': self.toggle_show,
+            'quit': self.quit,
+            'toggle_play': self.toggle_play_pressed,
+            'vol_up': lambda: self.change_volume(1),
+            'vol_down': lambda: self.change_volume(-1),
+            'nav_up': lambda: self.move_selection(-1),
+            'nav_down': lambda: self.move_selection(1),
+            'nav_mult_up': lambda: self.move_selection(-Settings.scroll_step),
+            'nav_mult_down': lambda: self.move_selection(Settings.scroll_step),
+            'search': self.toggle_search,
+            'yt_mode': self.toggle_youtube_mode,
+            'dump_latency': self.dump_latency,
+            'enqueue': self.enqueue,
+            'play_next': self.play_next,
+            'repeat': lambda: self.change_queue(self.queue.cycle_repeat),
+            'shuffle': lambda: self.change_queue(self.queue.toggle_shuffle),
+            'overlay': self.overlay
+        }
+        for name, (_, path) in Clips.items():
+            self.actions[f'clip {name}'] = lambda path=path: self.play_clip(path)
+        # hotkey to audio latency
+        self.latency = StageRecorder(('hook', 'dispatch', 'play', 'player_play', 'playing'))
+        self.pressed = None  # (hooked, dispatched) times of the key being handled
+
+        # tags, loudness and silence analysers, and the library, set up by load_library
+        self.metadata = None
+        self.loudness = None
+        self.silence = None
+        self.analysers = []  # all wait while something is playing
+        self.library = None
+        self.loaded = None  # (library, error, same songs as the snapshot) once loaded on a thread of its own
+        self.watcher = None
+        self.gain = 1.0  # of the song playing, to bring it to loudness_target
+        self.end_at = None  # ms into the song playing that it's trimmed to end at
+
+        # song list - shown straight from the snapshot written after the last scan if there is one, while the
+        # library is loaded and checked against the disk in the background
+        self.snapshot = None
+        self.snapshot_writer = None
+        if Settings.snapshot:
+            key = repr(([path for _, path in folders], Settings.scan_depth, Settings.scan_exclude,
+                        Settings.show_tags and Settings.read_metadata))
+            self.snapshot, path, sequence = open_latest(os.path.splitext(Settings.library_file)[0] + '.snapshot', key)
+            self.snapshot_writer = SnapshotWriter(path, key, sequence)
+            self.snapshot_writer.start()
+        self.song_list = self.snapshot
         self.youtube_list = []
-
-        # initialise vlc
-        self.instance = vlc.Instance('--no-video')
-        self.p = self.instance.media_player_new()
+        if self.snapshot:
+            threading.Thread(target=self.load_in_background, daemon=True).start()
+            self.root.after(50, self.poll_library)
+        else:
+            self.adopt_library(*self.load_library())
+            self.populate_song_list()
+            if self.snapshot_writer:
+                self.snapshot_writer.save(self.song_list)
+
+        # vlc - one instance for the whole session, and one player unless a prebuffered one is played
+        # vlc takes a while to start, so it's set up by start_vlc once the song list is on screen
+        self.instance = None
+        self.p = None
+        self.player_events = PlayerEvents(playing=self.player_playing)
+        self.controller = PlayController(self.play, self.stop, lambda: self.is_playing)
+        self.routed = True
+        self.start_callback = None
+        self.player_volume = None  # vlc's default until the volume is changed
+        self.prebuffer = None
+        self.prebuffer_callback = None
+        # crossfading alternates between the current player and a spare one, faded on their own thread
+        self.fader = None
+        self.spare = None
+        self.spare_lock = threading.Lock()
+        if Settings.crossfade:
+            self.fader = Fader()
+            self.fader.start()
+        # the mixer plays songs and clips over the music through an output of its own
+        self.mixer = None
+        self.soundboard = None
+        if Settings.mixer or Clips:
+            frames = RATE * Settings.mixer_buffer // 1000
+            self.mixer = Mixer(WaveOutSink(Settings.output_device, frames), frames)
+            self.mixer.start()
 
         # searches and labels
         self.search_var = tk.StringVar()
@@ -157,23 +354,14 @@ class WinDJ:
         self.button_youtube.grid(row=5, columnspan=2)
         self.search_box.grid_remove()
 
-        # scrollbar and listbox
-        self.scrollbar = tk.Scrollbar(self.root)
-        self.scrollbar.grid(row=1, column=0, sticky=(tk.N, tk.S))
-        self.listbox = tk.Listbox(self.root, yscrollcommand=self.scrollbar.set, selectmode=tk.BROWSE)
+        # scrollbar and listbox - only the rows on screen are ever in tk, however big the songlist
+        self.listbox = VirtualList(self.root, click=self.click, double_click=self.double_click)
+        self.listbox.listbox.bind('<Expose>', self.first_paint)
         self.populate_listbox()
-        self.listbox.grid(row=1, column=1, sticky=(tk.N, tk.S, tk.W, tk.E))
-        self.scrollbar.config(command=self.listbox.yview)
-
-        # ignore double controls on listbox
-        self.listbox.bind('<Up> <Down> <Left> <Right> <Next> <Prior>', self.ignore_event)
-
-        # bind clicks
-        self.listbox.bind('<Button-1>', self.click)
-        self.listbox.bind('<Double-Button-1>', self.double_click)
+        self.listbox.grid(row=1, column=0, columnspan=2, sticky=(tk.N, tk.S, tk.W, tk.E))
 
         # select first item
-        self.listbox.selection_set(0)
+        self.set_selection(0)
 
         # topmost window
         self.root.wm_attributes('-topmost', True)
@@ -186,100 +374,222 @@ class WinDJ:
         self.root.rowconfigure(1, weight=1)
         self.root.columnconfigure(1, weight=1)
 
+    def first_paint(self, _):
+        # tk draws the rows once it's idle, then vlc can start
+        self.listbox.listbox.unbind('<Expose>')
+        self.root.after_idle(self.song_list_shown)
+
+    def song_list_shown(self):
+        log.info('launch to song list shown: %.0f ms', process_age() * 1000)
+        self.start_vlc()
+
+    def start_vlc(self):
+        # also called before anything that needs vlc, in case that comes before the song list is shown
+        if self.instance:
+            return
+        self.instance = vlc.Instance('--no-video')
+        player = self.instance.media_player_new()
+        self.route_audio(player)
+        self.adopt_player(player)
+        # the selection and its neighbours, and the next song in the queue
+        self.prebuffer = Prebuffer(self.instance, 2 + 2 * Settings.prebuffer_neighbours, setup=self.route_audio)
+        if Clips:
+            self.soundboard = Soundboard(self.instance, self.mixer, [path for _, path in Clips.values()],
+                                         Settings.soundboard_memory * 2 ** 20, Settings.soundboard_policy)
+
     def ensure_top(self):
         self.root.lift()
         self.root.after(5000, self.ensure_top)
 
-    def ignore_event(self, _):
-        return 'break'
-
-    def button_press(self, _):
-        if not queue.empty():
-            self.handle_button(queue.get())
+    def load_library(self):
+        # (library, error) - the analysers' caches and the folder tree from disk, rescanned and listed
+        # on a thread of its own if the song list is showing from a snapshot meanwhile, so nothing here touches tk
+        if Settings.read_metadata:
+            self.metadata = MetadataPipeline(data_path('metadata.db'), workers=Settings.metadata_workers)
+        if Settings.normalize:
+            self.loudness = Analyser(data_path('analysis.db'), 'loudness', ('lufs',), measure_loudness, workers=2)
+        if Settings.skip_silence or Settings.trim_silence:
+            self.silence = Analyser(data_path('analysis.db'), 'silence', ('start', 'end'), measure_silence)
+        library = Library(
+            Settings.library_file, [path for _, path in folders], depth=Settings.scan_depth,
+            excludes=Settings.scan_exclude, workers=Settings.scan_workers,
+            display=self.tag_display if Settings.show_tags and self.metadata else None,
+            search_index=Settings.search_index
+        )
+        try:
+            library.rescan()
+        except OSError as e:
+            return library, e
+        library.songs()
+        return library, None
+
+    def load_in_background(self):
+        library, error = self.load_library()
+        self.loaded = library, error, not error and unchanged(self.snapshot, library.songs())
+
+    def poll_library(self):
+        # swaps the snapshot's songs for the library's once it's loaded, keeping what's showing where possible
+        if self.loaded is None:
+            self.root.after(50, self.poll_library)
+            return
+        library, error, same = self.loaded
+        snapshot, self.snapshot = self.snapshot, None
+        self.adopt_library(library, error)
+        songs = self.library.songs()
+        if same:
+            # the same songs in the same places, so whatever is showing only has to point at the library's list
+            for view in [results for _, results in self.search_stack] + [self.song_list]:
+                if isinstance(view, SongView) and view.songs is snapshot:
+                    view.songs = songs
+            self.search_stack = [(query, songs if results is snapshot else results)
+                                 for query, results in self.search_stack]
+            if self.song_list is snapshot:
+                self.song_list = songs
+                self.listbox.items = songs
+            return
+        self.snapshot_writer.save(songs)
+        if self.youtube_mode:
+            return  # the library's songs are listed when it's turned off
+        if self.is_searching:
+            self.search_stack = [('', songs)]
+            self.search_songlist()
+        else:
+            index = self.selected
+            key = snapshot.sort_key(index) if index < len(snapshot) else None
+            self.populate_song_list()
+            self.populate_listbox()
+            self.set_selection(min(songs.find(key), len(songs) - 1) if key else 0)
+
+    def adopt_library(self, library, error):
+        if error:
+            errorbox(f'You have specified an invalid folder:\n{error.filename}')
+            sys.exit(0)
+        self.library = library
+        self.analysers = [analyser for analyser in (self.metadata, self.loudness, self.silence) if analyser]
+        paths = self.song_paths()
+        for analyser in self.analysers:
+            analyser.submit(paths)
+            analyser.start()
+            if self.state == 'playing':
+                analyser.pause()
+
+        # pick up changes to the folders in the background
+        if Settings.watch_folders:
+            self.watcher = FolderWatcher(Settings.scan_exclude, Settings.scan_depth, Settings.watch_interval)
+            self.watcher.watch(self.library.depths())
+            self.watcher.start()
+            self.root.after(500, self.apply_library_changes)
+
+    def rescan_library(self):
+        # only re-lists folders that have changed since the last scan, throughput goes to windj.log
+        try:
+            stats = self.library.rescan()
+        except OSError as e:
+            errorbox(f'You have specified an invalid folder:\n{e.filename}')
+            sys.exit(0)
+        if self.watcher:
+            self.watcher.watch(self.library.depths())
+        if stats.listed and self.snapshot_writer:
+            self.snapshot_writer.save(self.library.songs())
+        return stats
+
+    def songs(self):
+        # the library's song list, or the snapshot's until the library has been loaded
+        return self.library.songs() if self.library else self.snapshot
+
+    def song_paths(self):
+        return [os.path.join(entry['path'], entry['filename']) for entry in self.library.songs()]
+
+    def tag_display(self, path, filename):
+        display = self.metadata.display(path, filename)
+        return non_bmp.sub('\ufffd', display) if display else None
+
+    def apply_library_changes(self):
+        # batches of relisted folders from the watcher are applied in place, keeping sort order and selection
+        while not self.watcher.results.empty():
+            results = self.watcher.results.get()
+            ops = self.library.apply(results)
+            self.watcher.watch(self.library.depths())
+            if ops and self.snapshot_writer:
+                self.snapshot_writer.save(self.library.song_list)
+            paths = [os.path.join(path, filename) for path, _, _, files, _ in results if files for filename in files]
+            for analyser in self.analysers:
+                analyser.submit(paths)
+            if ops and not self.youtube_mode:
+                # search results are positions into the library's list, so they have to follow it
+                # the bottom of the search stack is the library's own list, already updated
+                views = [results for _, results in self.search_stack[1:]]
+                if self.song_list is not self.library.song_list and all(view is not self.song_list for view in views):
+                    # the cut-off top of ranked results
+                    views.append(self.song_list)
+                listbox_ops = ops
+                for view in views:
+                    view_ops = view.remap(ops)
+                    if view is self.song_list:
+                        listbox_ops = view_ops
+                ops = listbox_ops
+                # song_list is already updated - keep the same song selected and redraw the rows on screen
+                selected = self.selected
+                for op in ops:
+                    if op[0] == 'delete':
+                        if op[1] < selected:
+                            selected -= 1
+                    elif op[1] <= selected:
+                        selected += 1
+                self.listbox.refresh()
+                self.listbox.select(max(0, min(selected, self.listbox.size() - 1)))
+        self.root.after(500, self.apply_library_changes)
 
     def populate_song_list(self):
-        song_list = []
-        index = 0
-        for folder in folders:
-            value, path = folder
-            try:
-                filenames = sorted(os.listdir(path))
-            except OSError:
-                errorbox(f'You have specified an invalid folder:\n{path}')
-                sys.exit(0)
-            for filename in filenames:
-                display = os.path.splitext(filename)[0]
-                song_list.append({'index': index, 'path': path, 'filename': filename, 'display': display})
-                index += 1
+        song_list = self.songs()
         if not song_list:
             errorbox('There are no files in the folders selected.')
         self.song_list = song_list
 
     @property
     def selected(self):
-        return self.listbox.curselection()[0] if self.listbox.curselection() else 0
-
-    def release_play_lock(self):
-        self.play_lock = False
+        return self.listbox.selection
 
     def click(self, event):
         idx = self.listbox.nearest(event.y)
         self.set_selection(idx)
 
     def double_click(self, event):
+        self.start_vlc()
         self.click(event)
         self.play()
 
     def set_selection(self, idx):
-        self.listbox.selection_clear(0, tk.END)
-        self.listbox.selection_set(idx)
-        self.listbox.activate(idx)
-        self.listbox.see(idx)
-
-    def handle_button(self, key):
-        if key == Controls.toggle_play:
-            if not self.play_lock:
-                self.play_lock = True  # when no lock, holding play gives crashes
-                self.root.after(400, self.release_play_lock)
-                self.toggle_play()
-        elif key == Controls.nav_up:
-            if self.selected > 0:
-                self.set_selection(self.selected - 1)
-        elif key == Controls.nav_down:
-            if self.selected < self.listbox.size() - 1:
-                self.set_selection(self.selected + 1)
-        elif key == Controls.nav_mult_up:
-            if self.selected >= Settings.scroll_step - 1:
-                self.set_selection(self.selected - Settings.scroll_step)
-            else:
-                self.set_selection(0)
-        elif key == Controls.nav_mult_down:
-            if self.selected <= self.listbox.size() - 1 - Settings.scroll_step:
-                self.set_selection(self.selected + Settings.scroll_step)
-            else:
-                self.set_selection(self.listbox.size() - 1)
-        elif key == Controls.vol_up:
-            if self.saved_volume < 100:
-                self.saved_volume += 1
-                self.p.audio_set_volume(self.saved_volume * 2)
-                self.update_labels()
-        elif key == Controls.vol_down:
-            if self.saved_volume > 0:
-                self.saved_volume -= 1
-                self.p.audio_set_volume(self.saved_volume * 2)
-                self.update_labels()
-        elif key == Controls.search:
-            self.toggle_search()
-        elif key == Controls.yt_mode:
-            self.toggle_youtube_mode()
-        elif key == Controls.toggle_show:
-            self.toggle_show()
-        elif key == Controls.reset:
-            self.reset()
-        elif key == Controls.quit:
-            self.root.quit()
-            self.root.destroy()
-        elif self.is_searching:
+        self.listbox.select(idx)
+        self.schedule_prebuffer()
+
+    def schedule_prebuffer(self):
+        # prepare the songs around the selection once it has stayed put for a moment
+        if Settings.prebuffer:
+            if self.prebuffer_callback:
+                self.root.after_cancel(self.prebuffer_callback)
+            self.prebuffer_callback = self.root.after(Settings.prebuffer_delay, self.prebuffer_selection)
+
+    def prebuffer_selection(self):
+        self.prebuffer_callback = None
+        self.start_vlc()
+        selected = self.selected
+        neighbours = range(selected - Settings.prebuffer_neighbours, selected + Settings.prebuffer_neighbours + 1)
+        # furthest first, so the selected song is the last to be evicted
+        for index in sorted(neighbours, key=lambda index: -abs(index - selected)):
+            if 0 <= index < len(self.song_list) and 'path' in self.song_list[index]:
+                entry = self.song_list[index]
+                self.prebuffer.prepare(*self.local_paths(entry), self.media_options(entry))
+
+    def handle_button(self, chord, hooked=None):
+        self.start_vlc()
+        action, _ = keymap.lookup(chord)
+        if action:
+            self.pressed = (hooked, time.perf_counter())
+            self.actions[action]()
+            self.pressed = None
+        elif self.is_searching and not chord[0] & ~SHIFT:
+            key = chord[1]
             process = False
             if len(key) == 1:
                 # not control character
@@ -302,9 +612,58 @@ class WinDJ:
                     self.youtube_thread.daemon = True
                     self.youtube_thread.start()
                 else:
-                    self.populate_song_list()
                     self.search_songlist()
 
+    def toggle_play_pressed(self):
+        self.listbox.focus_set()
+        self.controller.toggle()
+
+    def change_volume(self, step):
+        if 0 <= self.saved_volume + step <= 100:
+            self.saved_volume += step
+            self.player_volume = self.saved_volume * 2
+            if self.fader:
+                self.fader.cancel(self.p)
+            self.p.audio_set_volume(self.song_volume)
+            self.update_labels()
+
+    def move_selection(self, step):
+        self.set_selection(max(0, min(self.selected + step, self.listbox.size() - 1)))
+
+    def quit(self):
+        if self.prebuffer:
+            self.prebuffer.clear()
+        if self.fader:
+            self.fader.finish()
+        if self.spare:
+            self.spare.release()
+        if self.soundboard:
+            self.soundboard.close()
+        if self.mixer:
+            self.mixer.close()
+        # set up on the loader thread if the song list came from a snapshot, so not necessarily in analysers yet
+        for analyser in (self.metadata, self.loudness, self.silence):
+            if analyser:
+                analyser.close()
+        if self.instance:
+            self.p.stop()
+            self.p.release()
+            self.instance.release()
+        self.root.quit()
+        self.root.destroy()
+
+    def dump_latency(self):
+        log.info('latency:\n%s', self.latency.dump())
+        if self.fader:
+            log.info('crossfade lateness: %s', self.fader.lateness.summary())
+        if self.mixer:
+            log.info('mixer cpu per buffer: %s', self.mixer.cpu.summary())
+            log.info('mixer latency: %s', self.mixer.latency.summary())
+
+    def update_mode(self):
+        # which set of controls applies
+        keymap.mode = ('youtube' if self.youtube_mode else 'search') if self.is_searching else 'normal'
+
     def toggle_search(self):
         self.hide_search() if self.is_searching else self.show_search()
 
@@ -314,13 +673,25 @@ class WinDJ:
         self.show()
         self.search_string = ''
         self.search_var.set(self.search_string)
+        self.search_stack = [('', self.songs())]
         self.set_selection(0)
+        self.update_mode()
 
     def hide_search(self):
         self.is_searching = False
+        self.update_mode()
         self.search_box.grid_remove()
+        self.search_stack = []
+        self.search_generation += 1
+        self.search_pending = None
+        self.search_worker.cancel()
         index = self.song_list[self.selected]['index'] if self.song_list else 0
         if not self.youtube_mode:
+            if self.library and self.rescan_library().listed and self.analysers:
+                # unchanged files are skipped by the analysers on their mtime
+                paths = self.song_paths()
+                for analyser in self.analysers:
+                    analyser.submit(paths)
             self.populate_song_list()
         self.populate_listbox()
         self.set_selection(index)
@@ -342,48 +713,279 @@ class WinDJ:
         self.populate_listbox()
         self.button_youtube.config(relief=tk.RAISED)
 
-    def toggle_play(self):
-        self.listbox.focus_set()
-        self.stop() if self.is_playing else self.play()
+    def adopt_player(self, player):
+        # the player everything is played through from now on
+        self.player_events.watch(player)
+        self.p = player
 
-    def play(self):
-        self.is_playing = True
-        entry = self.song_list[self.selected]
+    def player_playing(self):
+        # called from a vlc thread, through player_events
+        self.latency.mark('playing')
 
-        if 'path' in entry:
-            # play from file
-            path = entry['path'] + '/' + entry['filename']
-            path = path.replace('\\', '\\\\')
+    @property
+    def volume(self):
+        # the player's volume, vlc's default being 100
+        return 100 if self.player_volume is None else self.player_volume
+
+    @property
+    def song_volume(self):
+        # the player's volume with the playing song's loudness evened out
+        return min(200, round(self.volume * self.gain))
+
+    def spare_player(self):
+        with self.spare_lock:
+            player, self.spare = self.spare, None
+        if player is None:
+            player = self.instance.media_player_new()
+            self.route_audio(player)
+        return player
+
+    def fade_out(self, player):
+        # the song that's playing fades out while the next one fades in, then its player is the spare
+        volume = player.audio_get_volume()
+        self.fader.fade(player, volume if volume >= 0 else self.song_volume, 0, Settings.crossfade / 1000,
+                        done=self.retire_player)
+
+    def retire_player(self, player):
+        # called from the fader thread, so stopping it doesn't hold up the ui
+        player.stop()
+        player.set_media(None)
+        with self.spare_lock:
+            if self.spare is None:
+                self.spare = player
+                return
+        player.release()
+
+    def route_audio(self, player):
+        # sends the player's audio to the output device before anything plays, True if it's there
+        # vlc creates the audio output with the player, so this normally takes effect straight away
+        if not Settings.output_device:
+            return True
+        player.audio_output_device_set(None, Settings.output_device)
+        return player.audio_output_device_get() == Settings.output_device
+
+    def cancel_start(self):
+        if self.start_callback:
+            self.root.after_cancel(self.start_callback)
+            self.start_callback = None
+
+    def wait_for_start(self):
+        # until vlc has started the song (or failed to), then the next toggle can run
+        if self.state == 'playing' and not self.player_events.settled.is_set():
+            self.start_callback = self.root.after(10, self.wait_for_start)
+            return
+        self.start_callback = None
+        if not self.routed and self.state == 'playing':
+            # the audio output couldn't be moved before playing, but it exists now
+            self.p.audio_output_device_set(None, Settings.output_device)
+            self.p.audio_set_mute(False)
+            self.routed = True
+        if self.state == 'playing':
+            self.prefetch_next()
+            self.watch_for_end()
+        self.controller.started()
+
+    def prefetch_next(self):
+        # opens the next song in the queue, paused, so it can follow on without a gap
+        entry = self.queue.peek(self.playing_entry)
+        if entry is not None and ('path' in entry or 'stream' in entry):
+            self.prebuffer.prepare(*self.media_source(entry), self.media_options(entry))
+
+    def watch_for_end(self):
+        # sleeps until just before the end of the song, then watches closely for it to end so the next song
+        # in the queue starts straight away - the window may be hidden, so player events aren't being picked up
+        self.end_callback = None
+        self.apply_player_events()
+        if self.start_callback or self.end_callback:
+            return  # it moved on to the next song, which is watched once it has started
+        if self.state != 'playing' or self.queue.peek(self.playing_entry) is None:
+            return
+        length = self.end_at or self.length or (self.metadata and self.playing_path and
+                                                self.metadata.duration(self.playing_path))
+        remaining = length - self.position if length else None
+        if remaining is not None and self.fader and remaining <= Settings.crossfade:
+            self.advance()  # the next song fades in over the end of this one
+            return
+        if remaining is None:
+            delay = 250
+        elif remaining > QUEUE_LEAD + Settings.crossfade:
+            delay = remaining - QUEUE_LEAD - Settings.crossfade
         else:
-            # play from youtube - get audio stream url
-            vid = pafy.new(f'https://www.youtube.com{entry["url"]}')
-            path = vid.getbestaudio().url
+            self.prefetch_next()  # in case it has since been evicted
+            delay = 10 if remaining < Settings.crossfade + 250 else 100
+        self.end_callback = self.root.after(delay, self.watch_for_end)
+
+    def cancel_end_watch(self):
+        if self.end_callback:
+            self.root.after_cancel(self.end_callback)
+            self.end_callback = None
+
+    def local_paths(self, entry):
+        # (path, path as given to vlc) of a song from the library
+        path = entry['path'] + '/' + entry['filename']
+        return os.path.join(entry['path'], entry['filename']), path.replace('\\', '\\\\')
+
+    def media_source(self, entry):
+        # (key it's prebuffered under, path or url given to vlc)
+        if 'path' in entry:
+            return self.local_paths(entry)
+        if 'stream' not in entry:
+            self.resolve_stream(entry)
+        return entry['url'], entry['stream']
+
+    def sound_bounds(self, entry):
+        # (start, end) in ms of where a song from the library is played from and to, skipping its silence
+        # either is None if it's played from the beginning or to the end
+        found = self.silence and 'path' in entry and self.silence.get(self.local_paths(entry)[0])
+        if not found:
+            return None, None
+        start, end = found
+        return start if Settings.skip_silence and start else None, end if Settings.trim_silence else None
+
+    def media_options(self, entry):
+        start, end = self.sound_bounds(entry)
+        options = []
+        if start:
+            options.append(f':start-time={start / 1000:.3f}')
+        if end:
+            options.append(f':stop-time={end / 1000:.3f}')
+        return options
+
+    def resolve_stream(self, entry):
+        # the audio stream url of a youtube entry
+        import pafy  # only loaded once youtube is used, as it takes a while
+        vid = pafy.new(f'https://www.youtube.com{entry["url"]}')
+        entry['stream'] = vid.getbestaudio().url
+
+    def prefetch_stream(self, entry):
+        # from a background thread, as resolving takes a while. if it fails it's tried again when played
+        try:
+            self.resolve_stream(entry)
+        except Exception:
+            pass
+
+    def queue_entry(self, entry):
+        # a copy of a songlist entry that stays valid as the songlist changes
+        if 'path' in entry:
+            return {'path': entry['path'], 'filename': entry['filename'], 'display': entry['display']}
+        entry = dict(entry)
+        threading.Thread(target=self.prefetch_stream, args=(entry,), daemon=True).start()
+        return entry
 
-        self.p.set_media(self.instance.media_new(path))
-        self.playing_name = entry['display']
-        self.p.play()
-        self.root.after(350, self.set_device)  # hackery for some reason...
+    def enqueue(self):
+        if self.song_list:
+            self.queue.add(self.queue_entry(self.song_list[self.selected]))
+            self.queue_changed()
+
+    def play_next(self):
+        if self.is_playing:
+            self.advance()
+        elif self.queue:
+            self.play(self.queue.next(None))
+
+    def change_queue(self, change):
+        change()
+        self.queue_changed()
+
+    def queue_changed(self):
+        if self.state == 'playing' and not self.start_callback:
+            self.cancel_end_watch()
+            self.prefetch_next()
+            self.watch_for_end()
+        self.update_labels()
 
+    def overlay(self):
+        # plays the selected song over whatever is playing, without stopping it
+        if self.mixer and self.song_list:
+            path = self.media_source(self.song_list[self.selected])[1]
+            self.mixer.add(DecoderSource(self.instance, path, gain=self.volume / 100))
+
+    def play_clip(self, path):
+        # straight from memory, the songlist and the song playing are left alone
+        self.soundboard.play(path, self.volume / 100)
+
+    def advance(self):
+        # straight on to the next song in the queue, False if there isn't one
+        entry = self.queue.next(self.playing_entry)
+        if entry is None:
+            return False
+        self.start(entry)
+        self.update_labels()
+        return True
+
+    def play(self, entry=None):
+        hooked, dispatched = self.pressed or (None, None)
+        self.latency.begin(hook=hooked, dispatch=dispatched, play=time.perf_counter())
+        self.start(entry if entry is not None else self.song_list[self.selected])
         if Settings.hide_on_play:
             self.hide()
         if self.is_searching:
             self.hide_search()
         self.update_labels()
 
+    def start(self, entry):
+        # a song that's still playing fades out instead of being cut off, if crossfading
+        fading = self.fader and self.state == 'playing'
+        self.state = 'playing'
+        self.position = self.length = 0
+        self.cancel_end_watch()
+        self.playing_entry = entry
+        self.playing_path = self.local_paths(entry)[0] if 'path' in entry else None
+        key, path = self.media_source(entry)
+        lufs = self.loudness and self.playing_path and self.loudness.get(self.playing_path)
+        self.gain = loudness_gain(lufs[0], Settings.loudness_target) if lufs else 1.0
+        options = self.media_options(entry)
+        self.end_at = self.sound_bounds(entry)[1]
+
+        player = self.prebuffer.take(key)
+        if fading:
+            self.fade_out(self.p)
+        if player:
+            # already opened and paused at the start of the song
+            if not fading:
+                self.prebuffer.release(self.p)
+            self.adopt_player(player)
+        else:
+            if fading:
+                self.adopt_player(self.spare_player())
+            media = self.instance.media_new(path)
+            for option in options:
+                media.add_option(option)
+            self.p.set_media(media)
+            media.release()  # the player keeps its own reference
+        if self.player_volume is not None or self.loudness:
+            self.p.audio_set_volume(self.song_volume)
+        self.playing_name = entry['display']
+        # muted until it's on the right device, so nothing leaks out of the default one
+        self.cancel_start()
+        self.routed = self.route_audio(self.p)
+        self.p.audio_set_mute(not self.routed)
+        self.player_events.reset()
+        if fading:
+            self.fader.fade(self.p, 0, self.song_volume, Settings.crossfade / 1000)
+        self.latency.mark('player_play')
+        self.p.play()
+        self.wait_for_start()
+        # keep tag parsing and analysis off the disk and cpu while playing
+        for analyser in self.analysers:
+            analyser.pause()
+
     def stop(self):
-        self.is_playing = False
+        self.state = 'stopped'
+        self.latency.cancel()
+        self.cancel_start()
+        self.cancel_end_watch()
+        if self.fader:
+            self.fader.finish()  # anything fading out stops now too
         self.p.stop()
-        self.instance = vlc.Instance()
-        self.p = self.instance.media_player_new()
+        self.p.set_media(None)  # frees the media and its demuxer
+        self.schedule_prebuffer()
+        for analyser in self.analysers:
+            analyser.resume()
         if Settings.show_on_stop:
             self.show()
         self.update_labels()
-
-    def set_device(self):
-        self.p.audio_output_device_set(None, Settings.output_device)
-        self.p.pause()
-        self.root.after(10)
-        self.p.pause()
+        self.controller.started()  # in case it was stopped before vlc had started it
 
     def toggle_show(self):
         self.hide() if self.is_visible else self.show()
@@ -391,57 +993,151 @@ class WinDJ:
     def hide(self):
         self.is_visible = False
         self.root.withdraw()
+        if self.player_callback:
+            self.root.after_cancel(self.player_callback)
+            self.player_callback = None
 
     def show(self):
         self.is_visible = True
         self.root.update()
         self.root.deiconify()
+        self.apply_player_events()
+        self.watch_player()
+
+    @property
+    def is_playing(self):
+        # play is toggled on, even if the song has since ended
+        return self.state != 'stopped'
+
+    def watch_player(self):
+        # the player's events are picked up in batches while it's playing and the window is shown,
+        # otherwise they wait for the window to be shown again
+        if self.player_callback is None and self.state == 'playing' and self.is_visible:
+            self.player_callback = self.root.after(250, self.poll_player)
+
+    def poll_player(self):
+        self.player_callback = None
+        self.apply_player_events()
+        self.watch_player()
+
+    def apply_player_events(self):
+        batch = self.player_events.take()
+        if batch is None or self.state == 'stopped':
+            return
+        state, position, length = batch
+        self.position = position or self.position
+        self.length = length or self.length
+        if state in ('ended', 'error') and self.state == 'playing':
+            if state == 'error':
+                log.warning('vlc could not play %s', self.playing_name)
+            if self.advance():
+                return
+            # stays toggled on, so WinDJ is still in step with an in-game toggle on the same key
+            self.state = state
+            for analyser in self.analysers:
+                analyser.resume()
+            self.update_labels()
+        else:
+            self.update_timer()
 
     def update_labels(self):
         if self.is_playing:
-            playing = 'Playing'
+            playing = {'playing': 'Playing', 'ended': 'Ended', 'error': 'Error'}[self.state]
             songname = self.playing_name
             self.update_timer()
+            self.watch_player()
         else:
             playing = 'Stopped'
             songname = '-'
-            if self.timer_callback:
-                self.root.after_cancel(self.timer_callback)
+            self.timer_text = None
             self.timer_var.set('-')
 
+        queued = ''
+        if self.queue or self.queue.repeat != 'off' or self.queue.shuffle:
+            modes = [name for name, on in (('shuffle', self.queue.shuffle), (f'repeat {self.queue.repeat}',
+                                                                             self.queue.repeat != 'off')) if on]
+            queued = f' | Queue: {len(self.queue)}' + (f' ({", ".join(modes)})' if modes else '')
         self.songname_var.set(songname)
-        self.status_var.set(f'{playing} | Volume: {self.saved_volume}')
+        self.status_var.set(f'{playing} | Volume: {self.saved_volume}{queued}')
 
     def update_timer(self):
-        curtime = '%d:%02d' % divmod(round(self.p.get_time()/1000), 60)
-        tottime = '%d:%02d' % divmod(round(self.p.get_length()/1000), 60)
-        self.timer_var.set(f'{curtime} / {tottime}')
-        self.timer_callback = self.root.after(500, self.update_timer)
+        length = self.length
+        if length <= 0 and self.metadata and self.playing_path:
+            # not known until vlc has opened the file, use the parsed duration meanwhile
+            length = self.metadata.duration(self.playing_path) or 0
+        position = length if self.state == 'ended' else self.position
+        curtime = '%d:%02d' % divmod(round(position/1000), 60)
+        tottime = '%d:%02d' % divmod(round(length/1000), 60)
+        if f'{curtime} / {tottime}' != self.timer_text:
+            self.timer_text = f'{curtime} / {tottime}'
+            self.timer_var.set(self.timer_text)
 
     def populate_listbox(self):
-        self.listbox.delete(0, tk.END)
-        for entry in self.song_list:
-            self.listbox.insert(tk.END, entry['display'])
+        self.listbox.set_items(self.song_list)
 
     def search_songlist(self):
-        self.song_list = [entry for entry in self.song_list if self.search_string in entry['display'].lower()]
+        # a longer query only narrows the previous results, a shorter one goes back to the cached results for it
+        fuzzy = Settings.search_mode == 'fuzzy'
+        query = normalize(self.search_string)
+        while len(self.search_stack) > 1 and not narrows(self.search_stack[-1][0], query, fuzzy):
+            self.search_stack.pop()
+        previous, results = self.search_stack[-1]
+        self.search_generation += 1
+        if previous == query:
+            self.search_pending = None
+            self.show_search_results(query, results)
+        else:
+            # searched on the worker so hotkeys stay responsive, the results come back to poll_search_results
+            if not self.search_polling:
+                self.search_polling = True
+                self.root.after(10, self.poll_search_results)
+            self.search_pending = self.search_generation
+            self.search_worker.submit(self.search_generation, query, results, fuzzy, self.songs().version)
+
+    def poll_search_results(self):
+        while not self.search_worker.results.empty():
+            generation, query, results, version = self.search_worker.results.get()
+            if generation != self.search_pending:
+                continue  # superseded by a newer keystroke
+            if results is None or version != self.songs().version:
+                # the watcher changed the songs mid-search, search them again
+                self.search_songlist()
+                continue
+            self.search_pending = None
+            self.search_stack.append((query, results))
+            self.show_search_results(query, results)
+        if self.search_pending is not None:
+            self.root.after(10, self.poll_search_results)
+        else:
+            self.search_polling = False
+
+    def show_search_results(self, query, results):
+        # ranked results are cut off so the listbox only ever holds the best few
+        fuzzy = Settings.search_mode == 'fuzzy'
+        self.song_list = results.top(Settings.search_results) if fuzzy and query else results
         self.populate_listbox()
         self.set_selection(0)
 
     def search_youtube(self):
-        self.listbox.delete(0, tk.END)
+        self.song_list = []
+        self.populate_listbox()
+        import requests  # only loaded once youtube is used, as it takes a while
         # sp searches for videos only
         payload = {'search_query': self.search_string, 'sp': 'EgIQAQ%3D%3D'}
         resp = requests.get('http://www.youtube.com/results', params=payload).text
         search_results = re.findall(r'<h3.+?href="(.+?)".+?title="(.+?)"', resp)
-        self.song_list = []
+        song_list = []
         for idx, result in enumerate(search_results):
-            display = html.unescape(result[1].translate(non_bmp_map))
-            self.song_list.append({'index': idx, 'url': result[0], 'display': display})
-            self.listbox.insert(tk.END, display)
+            display = html.unescape(non_bmp.sub('\ufffd', result[1]))
+            song_list.append({'index': idx, 'url': result[0], 'display': display})
+        self.song_list = song_list
+        self.populate_listbox()
         self.set_selection(0)
 
     def reset(self):
+        self.queue.clear()
+        if self.mixer:
+            self.mixer.clear()
         self.stop()
         self.hide_search()
         self.youtube_mode_off()
@@ -452,6 +1148,8 @@ class WinDJ:
 if __name__ == '__main__':
 
     multiprocessing.freeze_support()
+    logging.basicConfig(filename=data_path('windj.log'), level=logging.INFO,
+                        format='%(asctime)s %(levelname)s %(message)s')
 
     window = tk.Tk()
     window.resizable(width=False, height=False)
@@ -462,37 +1160,29 @@ if __name__ == '__main__':
     if Settings.fixed_position:
         window.overrideredirect(True)
     WinDJ = WinDJ(window)
-
-    queue = queue.Queue()
-    p_read, p_write = multiprocessing.Pipe(duplex=False)
-
-    def start_pipe_loop():
-        while True:
-            if p_read.poll(0.2):
-                _ = p_read.recv()
-                window.event_generate('<<keypressed>>', when='mark')
+    keys = KeyChannel(window, WinDJ.handle_button)
+    modifiers = Modifiers()
 
     def pyhook_keypress(event):
-        queue.put(event.Key)
-        p_write.send(1)
-        # controls captured by WinDJ and not passed through
-        if (Settings.controls_captured and event.Key in Controls.values() or
-                Settings.search_captured and WinDJ.is_searching):
-            if not Settings.toggle_play_captured and event.Key == Controls.toggle_play:
-                return True
-            return False
-        else:
-            return True
-
-    # poll the keyboard hook
-    pipeloop = threading.Thread(target=start_pipe_loop)
-    pipeloop.daemon = True
-    pipeloop.start()
+        chord = modifiers.press(event.Key)
+        action, captured = keymap.lookup(chord)
+        # holding toggle_play down toggles once, like an in-game bind
+        if not (modifiers.repeat and action == 'toggle_play'):
+            keys.put(chord)
+        # controls captured by WinDJ are not passed through
+        return not captured
+
+    def pyhook_keyrelease(event):
+        modifiers.release(event.Key)
+        return True
 
     # hook the keyboard
     obj = pyWinhook.HookManager()
     obj.KeyDown = pyhook_keypress
+    obj.KeyUp = pyhook_keyrelease
     obj.HookKeyboard()
 
     # main gui loop
     window.mainloop()
+    log.info('key latency: %s', keys.latency.summary())
+    WinDJ.dump_latency()
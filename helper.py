@@ -3,12 +3,15 @@
 
 import os
 import sys
-import queue
+import time
 import threading
 import pyWinhook
 import tkinter as tk
 import multiprocessing
 from tkinter import font
+from collections import deque
+from instrument import LatencyStats
+from keymap import Modifiers, chord_name
 
 
 def resource_path(relative_path):
@@ -22,6 +25,53 @@ def resource_path(relative_path):
     return os.path.join(base_path, relative_path)
 
 
+def data_path(filename):
+    """ Get absolute path to a persistent data file, kept outside the temporary install folder """
+    base_path = os.path.join(os.environ.get('LOCALAPPDATA', os.path.expanduser('~')), 'WinDJ')
+    os.makedirs(base_path, exist_ok=True)
+    return os.path.join(base_path, filename)
+
+
+class KeyChannel:
+    """ Hand keys from the keyboard hook to the tk loop in-process, waking it once per batch """
+
+    def __init__(self, root, handler):
+        self.root = root
+        self.handler = handler
+        self.keys = deque()  # (key, time hooked)
+        self.lock = threading.Lock()
+        self.wakeup_pending = False
+        self.latency = LatencyStats()  # hook to handler
+        self.closed = False  # once root is destroyed, e.g. by a quit key, the rest of the batch is dropped
+        self.root.bind('<<keypressed>>', self.drain)
+        self.root.bind('<Destroy>', self.close, add='+')
+
+    def put(self, key):
+        if self.closed:
+            return
+        self.keys.append((key, time.perf_counter()))
+        with self.lock:
+            if self.wakeup_pending:
+                return
+            self.wakeup_pending = True
+        self.root.event_generate('<<keypressed>>', when='tail')
+
+    def drain(self, _=None):
+        # cleared first, so a key hooked while handling this batch wakes the loop again
+        with self.lock:
+            self.wakeup_pending = False
+        while self.keys and not self.closed:
+            key, hooked = self.keys.popleft()
+            self.latency.add(time.perf_counter() - hooked)
+            self.handler(key, hooked)
+
+    def close(self, event):
+        # children being destroyed get here too, through the bindtags
+        if event.widget is self.root:
+            self.closed = True
+            self.keys.clear()
+
+
 class ErrorBox:
 
     def __init__(self, msg):
@@ -75,7 +125,6 @@ class HelperBox:
         default_font = font.nametofont('TkDefaultFont')
         default_font.configure(size=14)
         self.root.option_add('*Font', default_font)
-        self.root.bind('<<keypressed>>', self.button_press)
 
         self.player = vlc.Instance().media_player_new()
 
@@ -119,12 +168,8 @@ class HelperBox:
         ok.grid(row=3, padx=5, pady=(0, 5))
         ok.focus_set()
 
-    def button_press(self, _):
-        if not queue.empty():
-            self.handle_button(queue.get())
-
-    def handle_button(self, key):
-        self.scancodeval.set(f'KEY CODES:\n{str(key)}')
+    def handle_button(self, chord, _):
+        self.scancodeval.set(f'KEY CODES:\n{chord_name(chord)}')
 
     def dismiss(self):
         self.root.quit()
@@ -135,31 +180,23 @@ if __name__ == '__main__':
     multiprocessing.freeze_support()
 
     root = tk.Tk()
-
-    queue = queue.Queue()
-    p_read, p_write = multiprocessing.Pipe(duplex=False)
-
-    def start_pipe_loop():
-        while True:
-            if p_read.poll(0.2):
-                _ = p_read.recv()
-                root.event_generate('<<keypressed>>', when='mark')
+    WinDJHelper = HelperBox(root)
+    keys = KeyChannel(root, WinDJHelper.handle_button)
+    modifiers = Modifiers()
 
     def pyhook_keypress(event):
-        queue.put(event.Key)
-        p_write.send(1)
+        keys.put(modifiers.press(event.Key))
         return True
 
-    # poll the keyboard hook
-    pipeloop = threading.Thread(target=start_pipe_loop)
-    pipeloop.daemon = True
-    pipeloop.start()
+    def pyhook_keyrelease(event):
+        modifiers.release(event.Key)
+        return True
 
     # hook the keyboard
     obj = pyWinhook.HookManager()
     obj.KeyDown = pyhook_keypress
+    obj.KeyUp = pyhook_keyrelease
     obj.HookKeyboard()
 
     # main gui loop
-    WinDJHelper = HelperBox(root)
     root.mainloop()
@@ -0,0 +1,112 @@
+# WinDJ - David Ragusa
+# Refer to the LICENSE file.
+
+import os
+import sys
+import time
+import ctypes
+import threading
+from bisect import bisect_left
+from collections import deque
+
+BUCKETS = (0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000)  # upper bounds in ms
+
+
+def process_age():
+    # s since this process was started, so startup times include python starting and the imports
+    if sys.platform == 'win32':
+        kernel32 = ctypes.windll.kernel32
+        created, exited, kernel, user, now = (ctypes.c_ulonglong() for _ in range(5))  # 100 ns since 1601
+        kernel32.GetProcessTimes(ctypes.c_void_p(kernel32.GetCurrentProcess()), ctypes.byref(created),
+                                 ctypes.byref(exited), ctypes.byref(kernel), ctypes.byref(user))
+        kernel32.GetSystemTimePreciseAsFileTime(ctypes.byref(now))
+        return (now.value - created.value) / 1e7
+    with open('/proc/self/stat') as file:
+        started = int(file.read().rsplit(')', 1)[1].split()[19]) / os.sysconf('SC_CLK_TCK')
+    with open('/proc/uptime') as file:
+        return float(file.read().split()[0]) - started
+
+
+class LatencyStats:
+    # rolling window of latency samples in seconds, summarised as percentiles
+
+    def __init__(self, size=10000):
+        self.samples = deque(maxlen=size)
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+
+    def percentiles(self, *percents):
+        samples = sorted(self.samples)
+        if not samples:
+            return {}
+        return {percent: samples[min(len(samples) - 1, len(samples) * percent // 100)] for percent in percents}
+
+    def summary(self):
+        if not self.samples:
+            return 'no samples'
+        p = self.percentiles(50, 90, 99)
+        return (f'n={len(self.samples)} p50={p[50] * 1000:.2f}ms p90={p[90] * 1000:.2f}ms '
+                f'p99={p[99] * 1000:.2f}ms max={max(self.samples) * 1000:.2f}ms')
+
+
+class Histogram(LatencyStats):
+    # latency samples counted into fixed buckets as well, as they come in
+
+    def __init__(self, size=10000):
+        super().__init__(size)
+        self.counts = [0] * (len(BUCKETS) + 1)
+
+    def add(self, seconds):
+        super().add(seconds)
+        self.counts[bisect_left(BUCKETS, seconds * 1000)] += 1
+
+    def buckets(self):
+        # (label, count) for every bucket
+        labels = [f'<={bound}ms' for bound in BUCKETS] + [f'>{BUCKETS[-1]}ms']
+        return list(zip(labels, self.counts))
+
+
+class StageRecorder:
+    # timestamps of one path through the app, e.g. hotkey to audio, kept as a latency histogram per stage
+    # stages are measured from the first one, traces without it (e.g. play by mouse) aren't counted
+    # a trace ends when its last stage is reached, marks can come from any thread
+
+    def __init__(self, stages):
+        self.stages = stages
+        self.histograms = {stage: Histogram() for stage in stages[1:]}
+        self.lock = threading.Lock()
+        self.trace = None  # stage -> perf_counter time of the trace in progress
+
+    def begin(self, **stamps):
+        # starts a new trace, with any stages already passed stamped. stages left out are skipped
+        with self.lock:
+            self.trace = {}
+        for stage in self.stages:
+            if stamps.get(stage) is not None:
+                self.mark(stage, stamps[stage])
+
+    def mark(self, stage, stamp=None):
+        stamp = time.perf_counter() if stamp is None else stamp
+        with self.lock:
+            if self.trace is None or stage in self.trace:
+                return
+            start = self.trace.get(self.stages[0])
+            if start is not None:
+                self.histograms[stage].add(stamp - start)
+            self.trace[stage] = stamp
+            if stage == self.stages[-1]:
+                self.trace = None
+
+    def cancel(self):
+        with self.lock:
+            self.trace = None
+
+    def dump(self):
+        lines = []
+        with self.lock:
+            for stage, histogram in self.histograms.items():
+                lines.append(f'{self.stages[0]} -> {stage}: {histogram.summary()}')
+                if histogram.samples:
+                    lines.append('    ' + ' '.join(f'{label}:{count}' for label, count in histogram.buckets() if count))
+        return '\n'.join(lines)
@@ -0,0 +1,95 @@
+# WinDJ - David Ragusa
+# Refer to the LICENSE file.
+
+import time
+
+CTRL = 1
+SHIFT = 2
+ALT = 4
+WIN = 8
+MODIFIER_NAMES = {'ctrl': CTRL, 'control': CTRL, 'shift': SHIFT, 'alt': ALT, 'win': WIN}
+MODIFIER_KEYS = {
+    'Lcontrol': CTRL, 'Rcontrol': CTRL, 'Lshift': SHIFT, 'Rshift': SHIFT,
+    'Lmenu': ALT, 'Rmenu': ALT, 'Lwin': WIN, 'Rwin': WIN
+}
+MODES = ('normal', 'search', 'youtube')
+REPEAT_WINDOW = 1.0  # s, the longest key repeat delay windows allows
+
+
+def parse_chord(text):
+    # 'Ctrl+Shift+Numpad5' -> (CTRL | SHIFT, 'Numpad5')
+    *modifiers, key = [part.strip() for part in text.split('+')]
+    if not key:
+        raise ValueError(f'Missing key in \'{text}\'')
+    mask = 0
+    for modifier in modifiers:
+        if modifier.lower() not in MODIFIER_NAMES:
+            raise ValueError(f'Unknown modifier \'{modifier}\' in \'{text}\'')
+        mask |= MODIFIER_NAMES[modifier.lower()]
+    return mask, key
+
+
+def chord_name(chord):
+    mask, key = chord
+    return '+'.join([name for name, bit in (('Ctrl', CTRL), ('Shift', SHIFT), ('Alt', ALT), ('Win', WIN))
+                     if mask & bit] + [key])
+
+
+class Modifiers:
+    # which modifier keys are held, tracked from the hook's key down and key up events
+    # low level hooks don't flag key repeats, so repeat says if the last key pressed was already down
+
+    def __init__(self):
+        self.held = set()
+        self.mask = 0
+        self.down = {}  # key -> time of its last key down
+        self.repeat = False
+
+    def press(self, key):
+        # the chord for a key going down - a modifier's own bit is only added after its chord
+        now = time.monotonic()
+        # a key up that never arrived (e.g. focus went to an elevated window) only holds for so long
+        self.repeat = now - self.down.get(key, now - REPEAT_WINDOW) < REPEAT_WINDOW
+        self.down[key] = now
+        chord = (self.mask, key)
+        if key in MODIFIER_KEYS and key not in self.held:
+            self.held.add(key)
+            self.mask |= MODIFIER_KEYS[key]
+        return chord
+
+    def release(self, key):
+        self.down.pop(key, None)
+        if key in self.held:
+            self.held.discard(key)
+            self.mask = 0
+            for held in self.held:
+                self.mask |= MODIFIER_KEYS[held]
+
+
+class Keymap:
+    # the controls compiled into one hash table per mode, chord -> (action, captured)
+    # bindings are {mode: {action: 'chord, chord'}}, an empty string leaves the action unbound in that mode
+    # capture_bound and capture_unbound are {mode: bool}, whether keys are hidden from other programs
+    # pass_through actions are never captured
+
+    def __init__(self, bindings, capture_bound, capture_unbound, pass_through=()):
+        self.mode = 'normal'
+        self.unbound = {mode: (None, capture_unbound[mode]) for mode in MODES}
+        self.tables = {}
+        for mode in MODES:
+            table = self.tables[mode] = {}
+            for action, chords in bindings[mode].items():
+                for text in filter(None, (text.strip() for text in chords.split(','))):
+                    chord = parse_chord(text)
+                    if chord in table:
+                        raise ValueError(f'\'{text}\' is bound to both {table[chord][0]} and {action} in {mode} mode')
+                    table[chord] = (action, capture_bound[mode] and action not in pass_through)
+
+    def lookup(self, chord):
+        # (action, captured) in the current mode - this runs in the keyboard hook for every key on the system
+        table = self.tables[self.mode]
+        entry = table.get(chord)
+        if entry is None and chord[0]:
+            # a bare key binding still works with unbound modifiers held, e.g. shift to sprint in game
+            entry = table.get((0, chord[1]))
+        return entry or self.unbound[self.mode]
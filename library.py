@@ -0,0 +1,457 @@
+# WinDJ - David Ragusa
+# Refer to the LICENSE file.
+
+import os
+import time
+import sqlite3
+import fnmatch
+import logging
+from array import array
+from search import TrigramIndex, normalize, scan, rank
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+log = logging.getLogger('windj')
+
+SCHEMA_VERSION = 2
+
+Folder = namedtuple('Folder', 'mtime parent subdirs files')
+ScanStats = namedtuple('ScanStats', 'dirs listed files seconds')
+
+
+def list_dir(path, excludes):
+    # one scandir pass - subfolder mtimes come from the entries, so only subfolders are stat'ed
+    files, subdirs, mtimes = [], [], {}
+    with os.scandir(path) as it:
+        for entry in it:
+            if any(fnmatch.fnmatch(entry.name, pattern) for pattern in excludes):
+                continue
+            if entry.is_dir():
+                subdirs.append(entry.path)
+                mtimes[entry.path] = entry.stat().st_mtime_ns
+            elif entry.is_file():
+                files.append(entry.name)
+    return sorted(files), sorted(subdirs), mtimes
+
+
+class Song:
+    # a single song of a SongList, looked up on demand - supports the same entry['display'] access as a dict
+    __slots__ = ('songs', 'index')
+    keys = ('index', 'path', 'filename', 'display')
+
+    def __init__(self, songs, index):
+        self.songs = songs
+        self.index = index
+
+    def __getitem__(self, key):
+        if key == 'index':
+            return self.index
+        elif key == 'path':
+            return self.songs.folders[self.songs.folder_ids[self.index]]
+        elif key == 'filename':
+            return self.songs.filenames[self.index]
+        elif key == 'display':
+            return self.songs.displays[self.index]
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in self.keys
+
+    def get(self, key, default=None):
+        return self[key] if key in self.keys else default
+
+
+class SongList:
+    # compact song list for big libraries - one array per field rather than a dict per song,
+    # with each folder path stored once
+
+    def __init__(self):
+        self.folders = []
+        self.folder_keys = []  # (root index, relative path parts) of each folder, to keep songs sorted
+        self.folder_index = {}
+        self.folder_ids = array('I')
+        self.filenames = []
+        self.displays = []
+        self.search_keys = []  # normalized displays, computed once rather than for every song on every keystroke
+        self.ids = array('I')  # stable song ids, which unlike positions don't move when songs are inserted
+        self.next_id = 0
+        self.id_positions = array('I')  # id -> position + 1, 0 for deleted songs. rebuilt after inserts
+        self.index = None
+        self.version = 0  # bumped by every insert and delete, so searches on other threads can tell
+
+    def __len__(self):
+        return len(self.filenames)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('song index out of range')
+        return Song(self, index)
+
+    def __iter__(self):
+        return (Song(self, index) for index in range(len(self)))
+
+    def folder_id(self, path, key):
+        if path not in self.folder_index:
+            self.folder_index[path] = len(self.folders)
+            self.folders.append(path)
+            self.folder_keys.append(key)
+        return self.folder_index[path]
+
+    def new_id(self, key):
+        song_id = self.next_id
+        self.next_id += 1
+        if self.index is not None:
+            self.index.add(song_id, key)
+        return song_id
+
+    def append(self, folder_id, filename, display):
+        self.folder_ids.append(folder_id)
+        self.filenames.append(filename)
+        self.displays.append(display)
+        self.search_keys.append(normalize(display))
+        self.ids.append(self.new_id(self.search_keys[-1]))
+        if self.id_positions is not None:
+            self.id_positions.append(len(self))
+
+    def insert(self, index, folder_id, filename, display):
+        self.folder_ids.insert(index, folder_id)
+        self.filenames.insert(index, filename)
+        self.displays.insert(index, display)
+        self.search_keys.insert(index, normalize(display))
+        self.ids.insert(index, self.new_id(self.search_keys[index]))
+        self.id_positions = None
+        self.version += 1
+
+    def delete(self, index):
+        del self.folder_ids[index]
+        del self.filenames[index]
+        del self.displays[index]
+        del self.search_keys[index]
+        del self.ids[index]
+        self.id_positions = None
+        self.version += 1
+
+    def build_index(self):
+        self.index = TrigramIndex(self.ids, self.search_keys)
+
+    def positions(self):
+        # may be called from the search worker, so only publish the table once it's filled in
+        positions = self.id_positions
+        if positions is None:
+            positions = array('I', [0]) * self.next_id
+            for position, song_id in enumerate(self.ids, 1):
+                positions[song_id] = position
+            self.id_positions = positions
+        return positions
+
+    def sort_key(self, index):
+        root, parts = self.folder_keys[self.folder_ids[index]]
+        return root, parts + (self.filenames[index],)
+
+    def find(self, key):
+        # binary search on sort order - position of key, or where it would be inserted
+        low, high = 0, len(self)
+        while low < high:
+            mid = (low + high) // 2
+            if self.sort_key(mid) < key:
+                low = mid + 1
+            else:
+                high = mid
+        return low
+
+    def filter(self, match):
+        return SongView(self, array('I', (index for index, display in enumerate(self.displays) if match(display))))
+
+    def search(self, text, cancelled=None):
+        # returns None if cancelled
+        keys = self.search_keys
+        candidates = self.index.candidates(text, len(self) // 8) if self.index is not None and text else None
+        if candidates is None:
+            if hasattr(keys, 'containing'):
+                return SongView(self, keys.containing(text))  # read from a snapshot, searched in the mapped file
+            found = scan(text, keys, range(len(self)), cancelled)
+            return SongView(self, found) if found is not None else None
+        positions = self.positions()
+        found = (positions[song_id] - 1 for song_id in candidates if positions[song_id])
+        return SongView(self, array('I', sorted(index for index in found if text in keys[index])))
+
+    def fuzzy(self, query, cancelled=None):
+        found = rank(query, self.search_keys, range(len(self)), cancelled)
+        return SongView(self, found) if found is not None else None
+
+
+class SongView:
+    # filtered songs as positions into a SongList, rather than copies of the songs
+
+    def __init__(self, songs, indices):
+        self.songs = songs
+        self.indices = indices
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, index):
+        return self.songs[self.indices[index]]
+
+    def __iter__(self):
+        return (Song(self.songs, index) for index in self.indices)
+
+    def filter(self, match):
+        displays = self.songs.displays
+        return SongView(self.songs, array('I', (index for index in self.indices if match(displays[index]))))
+
+    def search(self, text, cancelled=None):
+        found = scan(text, self.songs.search_keys, self.indices, cancelled)
+        return SongView(self.songs, found) if found is not None else None
+
+    def fuzzy(self, query, cancelled=None):
+        found = rank(query, self.songs.search_keys, self.indices, cancelled)
+        return SongView(self.songs, found) if found is not None else None
+
+    def top(self, count):
+        return SongView(self.songs, self.indices[:count])
+
+    def remap(self, ops):
+        # follow ops applied to the underlying SongList, returning the ops this view's listbox needs
+        # songs inserted by the ops are left out - they show up with the next search
+        view_ops = []
+        for op in ops:
+            indices = self.indices
+            if op[0] == 'delete':
+                pos = next((i for i, index in enumerate(indices) if index == op[1]), None)
+                self.indices = array('I', (index - (index > op[1]) for index in indices if index != op[1]))
+                if pos is not None:
+                    view_ops.append(('delete', pos))
+            else:
+                self.indices = array('I', (index + (index >= op[1]) for index in indices))
+        return view_ops
+
+
+class Library:
+    # persistent song library - remembers each folder's mtime and contents so that
+    # only folders that have changed on disk since the last scan are listed again
+
+    def __init__(self, db_path, folders, depth=None, excludes=(), workers=4, display=None, search_index=False):
+        self.folders = folders
+        self.depth = depth
+        self.excludes = list(excludes)
+        self.workers = workers
+        self.tag_display = display  # optional (path, filename) -> display name or None
+        self.search_index = search_index
+        # may be loaded on a thread of its own, but it's only ever used from one thread at a time
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        options = repr((depth, self.excludes))
+        if self.db.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+            self.db.executescript('DROP TABLE IF EXISTS folders; DROP TABLE IF EXISTS files; DROP TABLE IF EXISTS meta;')
+            self.db.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS folders (path TEXT PRIMARY KEY, parent TEXT, mtime INTEGER NOT NULL);
+            CREATE TABLE IF NOT EXISTS files (
+                folder TEXT NOT NULL,
+                filename TEXT NOT NULL,
+                PRIMARY KEY (folder, filename)
+            );
+        ''')
+        if self.db.execute("SELECT value FROM meta WHERE key = 'options'").fetchone() != (options,):
+            # scan depth or excludes changed, stored folder contents can't be trusted
+            with self.db:
+                self.db.execute('DELETE FROM folders')
+                self.db.execute('DELETE FROM files')
+                self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('options', ?)", (options,))
+
+        self.tree = {}
+        for path, parent, mtime in self.db.execute('SELECT path, parent, mtime FROM folders'):
+            self.tree[path] = Folder(mtime, parent, [], [])
+        for path, folder in self.tree.items():
+            if folder.parent in self.tree:
+                self.tree[folder.parent].subdirs.append(path)
+        for folder, filename in self.db.execute('SELECT folder, filename FROM files'):
+            self.tree[folder].files.append(filename)
+        for folder in self.tree.values():
+            folder.subdirs.sort()
+            folder.files.sort()
+        self.song_list = None
+
+    def scan_dir(self, path, mtime, is_root):
+        # runs on a worker thread - returns None for a subfolder that has vanished or can't be read
+        # raises OSError (with the offending path as e.filename) for an invalid root folder
+        # the folder's real path comes back too, as symlinks and junctions can lead to a folder twice or in a loop
+        try:
+            real = os.path.realpath(path)
+            if mtime is None:
+                mtime = os.stat(path).st_mtime_ns
+            stored = self.tree.get(path)
+            if stored and stored.mtime == mtime:
+                return path, real, mtime, None
+            return path, real, mtime, list_dir(path, self.excludes)
+        except OSError:
+            if is_root:
+                raise
+            return None
+
+    def rescan(self):
+        # walk every folder tree concurrently, re-listing only the folders whose mtime has changed
+        start = time.perf_counter()
+        changed = {}
+        visited = set()
+        real_paths = set()  # of the folders visited, so each is only scanned once however many ways it's reached
+        listed = 0
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            pending = {pool.submit(self.scan_dir, path, None, True): (None, 0) for path in self.folders}
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    parent, depth = pending.pop(future)
+                    result = future.result()
+                    if result is None:
+                        continue
+                    path, real, mtime, listing = result
+                    if real in real_paths:
+                        continue
+                    real_paths.add(real)
+                    visited.add(path)
+                    if listing is None:
+                        subdirs, mtimes = self.tree[path].subdirs, {}
+                    else:
+                        files, subdirs, mtimes = listing
+                        changed[path] = Folder(mtime, parent, subdirs, files)
+                        listed += 1
+                    if self.depth is None or depth < self.depth:
+                        for subdir in subdirs:
+                            future = pool.submit(self.scan_dir, subdir, mtimes.get(subdir), False)
+                            pending[future] = (path, depth + 1)
+
+        removed = set(self.tree) - visited
+        if changed or removed:
+            self.update_folders(changed, removed)
+            self.song_list = None
+
+        stats = ScanStats(len(visited), listed, sum(len(self.tree[path].files) for path in visited),
+                          time.perf_counter() - start)
+        log.info('Scanned %d files in %d folders (%d listed) in %.2fs - %.0f files/s', stats.files, stats.dirs,
+                 stats.listed, stats.seconds, stats.files / stats.seconds if stats.seconds else 0)
+        return stats
+
+    def update_folders(self, changed, removed):
+        with self.db:
+            for path in removed:
+                self.db.execute('DELETE FROM files WHERE folder = ?', (path,))
+                self.db.execute('DELETE FROM folders WHERE path = ?', (path,))
+                del self.tree[path]
+            for path, folder in changed.items():
+                self.db.execute('DELETE FROM files WHERE folder = ?', (path,))
+                self.db.execute('INSERT OR REPLACE INTO folders (path, parent, mtime) VALUES (?, ?, ?)',
+                                (path, folder.parent, folder.mtime))
+                self.db.executemany('INSERT INTO files (folder, filename) VALUES (?, ?)',
+                                    ((path, filename) for filename in folder.files))
+                self.tree[path] = folder
+
+    def subtree(self, path):
+        folders = set()
+        stack = [path]
+        while stack:
+            path = stack.pop()
+            if path in self.tree:
+                folders.add(path)
+                stack.extend(self.tree[path].subdirs)
+        return folders
+
+    def depths(self):
+        # {path: (parent, depth, mtime)} for every folder, as handed to the folder watcher
+        depths = {}
+        stack = [(root, 0) for root in self.folders]
+        while stack:
+            path, depth = stack.pop()
+            folder = self.tree.get(path)
+            if folder is not None:
+                depths[path] = (folder.parent, depth, folder.mtime)
+                stack.extend((subdir, depth + 1) for subdir in folder.subdirs)
+        return depths
+
+    def folder_key(self, path, tree):
+        parts = []
+        while tree[path].parent is not None:
+            parts.append(os.path.basename(path))
+            path = tree[path].parent
+        return self.folders.index(path), tuple(reversed(parts))
+
+    def sort_key(self, path, filename, tree):
+        root, parts = self.folder_key(path, tree)
+        return root, parts + (filename,)
+
+    def apply(self, results):
+        # apply relisted folders from the watcher, updating the song list in place
+        # returns the ('delete', pos) and ('insert', pos, display) ops needed to bring a listbox in line
+        changed, removed = {}, set()
+        for path, parent, mtime, files, subdirs in results:
+            if files is None:
+                removed |= self.subtree(path)
+            else:
+                changed[path] = Folder(mtime, parent, subdirs, files)
+        for path, folder in changed.items():
+            if path in self.tree:
+                for subdir in set(self.tree[path].subdirs) - set(folder.subdirs):
+                    removed |= self.subtree(subdir)
+        removed -= set(changed)
+        if not changed and not removed:
+            return []
+
+        new_tree = {**self.tree, **changed}
+        old_songs = {(self.sort_key(path, filename, self.tree), path, filename)
+                     for path in removed | set(changed) if path in self.tree for filename in self.tree[path].files}
+        new_songs = {(self.sort_key(path, filename, new_tree), path, filename)
+                     for path, folder in changed.items() for filename in folder.files}
+        self.update_folders(changed, removed)
+        if self.song_list is None:
+            return []
+
+        ops = []
+        songs = self.song_list
+        for key, _, _ in sorted(old_songs - new_songs, reverse=True):
+            pos = songs.find(key)
+            if pos < len(songs) and songs.sort_key(pos) == key:
+                songs.delete(pos)
+                ops.append(('delete', pos))
+        for key, path, filename in sorted(new_songs - old_songs):
+            pos = songs.find(key)
+            display = self.display(path, filename)
+            songs.insert(pos, songs.folder_id(path, self.folder_key(path, self.tree)), filename, display)
+            ops.append(('insert', pos, display))
+        return ops
+
+    def display(self, path, filename):
+        if self.tag_display:
+            display = self.tag_display(path, filename)
+            if display:
+                return display
+        return os.path.splitext(filename)[0]
+
+    def walk(self, path, parts):
+        folder = self.tree.get(path)
+        if folder is None:
+            return
+        for filename in folder.files:
+            yield parts + (filename,), path, filename
+        for subdir in folder.subdirs:
+            yield from self.walk(subdir, parts + (os.path.basename(subdir),))
+
+    def songs(self):
+        # song list in folder order, each folder tree sorted by relative path
+        # built once per change and shared between callers
+        if self.song_list is None:
+            songs = SongList()
+            for root_index, root in enumerate(self.folders):
+                for parts, path, filename in sorted(self.walk(root, ())):
+                    folder_id = songs.folder_id(path, (root_index, parts[:-1]))
+                    songs.append(folder_id, filename, self.display(path, filename))
+            if self.search_index:
+                songs.build_index()
+            self.song_list = songs
+        return self.song_list
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,117 @@
+# WinDJ - David Ragusa
+# Refer to the LICENSE file.
+
+import os
+import vlc
+import queue
+import sqlite3
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+Tags = namedtuple('Tags', 'mtime size title artist album duration')
+
+
+class MetadataPipeline(threading.Thread):
+    # parses tags and durations of library files in the background, caching them on disk by path+mtime+size
+    # parsing waits while something is playing, lookups never wait on parsing
+
+    def __init__(self, db_path, workers=2, timeout=5000):
+        super().__init__(daemon=True)
+        self.db_path = db_path
+        self.workers = workers
+        self.timeout = timeout
+        self.paths = queue.Queue()
+        self.idle = threading.Event()
+        self.idle.set()
+        self.stopped = threading.Event()
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.instance = None
+
+        db = sqlite3.connect(db_path)
+        db.execute('''
+            CREATE TABLE IF NOT EXISTS tags (
+                path TEXT PRIMARY KEY, mtime INTEGER, size INTEGER,
+                title TEXT, artist TEXT, album TEXT, duration INTEGER
+            )
+        ''')
+        self.tags = {row[0]: Tags(*row[1:]) for row in db.execute('SELECT * FROM tags')}
+        db.close()
+
+    def submit(self, paths):
+        self.paths.put(list(paths))
+
+    def pause(self):
+        self.idle.clear()
+
+    def resume(self):
+        self.idle.set()
+
+    def close(self):
+        # parses waiting for the song to stop are let go and nothing queued is started, so exit isn't held up
+        self.stopped.set()
+        self.idle.set()
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+    def duration(self, path):
+        # in ms, None if unknown
+        tags = self.tags.get(path)
+        return tags.duration if tags else None
+
+    def display(self, path, filename):
+        # 'Artist - Title' if the file is tagged, otherwise None
+        tags = self.tags.get(os.path.join(path, filename))
+        if tags and tags.artist and tags.title:
+            return f'{tags.artist} - {tags.title}'
+        return None
+
+    def parse(self, path, stat):
+        self.idle.wait()
+        if self.stopped.is_set():
+            return None
+        media = self.instance.media_new(path)
+        parsed = threading.Event()
+        media.event_manager().event_attach(vlc.EventType.MediaParsedChanged, lambda _: parsed.set())
+        media.parse_with_options(vlc.MediaParseFlag.local, self.timeout)
+        parsed.wait(self.timeout / 1000 + 1)
+        duration = media.get_duration()
+        tags = Tags(
+            stat.st_mtime_ns, stat.st_size, media.get_meta(vlc.Meta.Title), media.get_meta(vlc.Meta.Artist),
+            media.get_meta(vlc.Meta.Album), duration if duration > 0 else None
+        )
+        media.release()
+        return path, tags
+
+    def store(self, db, futures):
+        with db:
+            for future in futures:
+                if future.cancelled() or future.exception() or future.result() is None:
+                    continue
+                path, tags = future.result()
+                db.execute('INSERT OR REPLACE INTO tags VALUES (?, ?, ?, ?, ?, ?, ?)', (path, *tags))
+                self.tags[path] = tags
+
+    def run(self):
+        db = sqlite3.connect(self.db_path)
+        self.instance = vlc.Instance('--no-video', '--quiet')
+        while True:
+            pending = set()
+            for path in self.paths.get():
+                self.idle.wait()
+                if self.stopped.is_set():
+                    return
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                cached = self.tags.get(path)
+                if cached and (cached.mtime, cached.size) == (stat.st_mtime_ns, stat.st_size):
+                    continue
+                try:
+                    pending.add(self.pool.submit(self.parse, path, stat))
+                except RuntimeError:
+                    return  # closed meanwhile
+                if len(pending) >= self.workers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    self.store(db, done)
+            self.store(db, wait(pending)[0])
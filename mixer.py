@@ -0,0 +1,370 @@
+# WinDJ - David Ragusa
+# Refer to the LICENSE file.
+
+import os
+import vlc
+import time
+import wave
+import ctypes
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+from collections import deque
+from contextlib import contextmanager
+from instrument import Histogram
+
+try:
+    import numpy as np
+except ImportError:
+    np = None  # the mixer is only available with numpy installed
+
+RATE = 48000
+CHANNELS = 2
+RELEASE = 1.02  # how fast the limiter lets the gain back up after a peak, per buffer
+
+
+def transcode(instance, path, wav, idle=None, stop=None, timeout=60, options=()):
+    # converts path to a 16 bit wav file at RATE as fast as vlc can, rather than in real time. True if it worked
+    # it pauses whenever idle is cleared, timeout only counts the time it isn't paused. setting stop gives up on it
+    # options are extra media options, e.g. ':stop-time=10' for the first 10 seconds
+    dst = wav.replace('\\', '\\\\')
+    media = instance.media_new(path)
+    media.add_option(f':sout=#transcode{{acodec=s16l,channels={CHANNELS},samplerate={RATE}}}'
+                     f':std{{access=file,mux=wav,dst="{dst}"}}')
+    for option in options:
+        media.add_option(option)
+    player = instance.media_player_new()
+    player.set_media(media)
+    media.release()
+    finished = threading.Event()
+    outcome = []
+    events = player.event_manager()
+    for event, name in ((vlc.EventType.MediaPlayerEndReached, 'ended'),
+                        (vlc.EventType.MediaPlayerEncounteredError, 'error')):
+        events.event_attach(event, lambda _, name=name: (outcome.append(name), finished.set()))
+    player.play()
+    waited = 0
+    while not finished.wait(0.1) and waited < timeout:
+        if stop is not None and stop.is_set():
+            break
+        if idle is not None and not idle.is_set():
+            player.set_pause(True)
+            idle.wait()
+            player.set_pause(False)
+        else:
+            waited += 0.1
+    player.stop()
+    player.release()
+    return outcome[:1] == ['ended']
+
+
+@contextmanager
+def decoded(instance, path, **kwargs):
+    # path transcoded to a temporary wav file, open for reading, or None if it couldn't be
+    fd, wav = tempfile.mkstemp(suffix='.wav')
+    os.close(fd)
+    try:
+        file = None
+        try:
+            if transcode(instance, path, wav, **kwargs):
+                file = wave.open(wav)
+        except (EOFError, wave.Error):
+            pass
+        try:
+            yield file
+        finally:
+            if file:
+                file.close()
+    finally:
+        os.remove(wav)
+
+
+class Source(ABC):
+    # something the mixer plays, read a buffer at a time from the mixer thread as 16 bit pcm (frames, channels)
+    # done is set once there's nothing more to read, then the mixer drops it
+
+    def __init__(self, gain=1.0):
+        self.gain = gain
+        self.done = False
+
+    @abstractmethod
+    def read(self, frames):
+        # (up to frames of pcm, perf_counter time the oldest of it arrived or None)
+        pass
+
+    def close(self):
+        pass
+
+
+class ClipSource(Source):
+    # pcm that's already in memory, played from the start. it counts as arriving when the source is made
+
+    def __init__(self, pcm, gain=1.0):
+        super().__init__(gain)
+        self.pcm = pcm
+        self.position = 0
+        self.made = time.perf_counter()
+
+    def read(self, frames):
+        arrived = self.made if self.position == 0 else None
+        pcm = self.pcm[self.position:self.position + frames]
+        self.position += len(pcm)
+        self.done = self.position >= len(self.pcm)
+        return pcm, arrived
+
+
+class DecoderSource(Source):
+    # a vlc player decoding into memory instead of to a sound card. vlc calls play from its own thread
+    # as the song goes, at the rate it's meant to be heard, and the pcm waits here for the mixer
+
+    def __init__(self, instance, mrl, gain=1.0, limit=2.0):
+        super().__init__(gain)
+        self.lock = threading.Lock()
+        self.chunks = deque()  # (pcm, perf_counter time it arrived)
+        self.offset = 0  # frames of the first chunk already read
+        self.buffered = 0  # frames
+        self.limit = int(limit * RATE)  # frames kept if the mixer falls behind, the oldest go first
+        self.primed = False  # the mixer waits for a full buffer before starting, so it doesn't stutter in
+        self.ended = False
+        # kept referenced, vlc only has their addresses
+        self.callbacks = (vlc.CallbackDecorators.AudioPlayCb(self.play),
+                          vlc.CallbackDecorators.AudioFlushCb(self.flush))
+        self.player = instance.media_player_new()
+        self.player.audio_set_callbacks(self.callbacks[0], None, None, self.callbacks[1], None, None)
+        self.player.audio_set_format('S16N', RATE, CHANNELS)
+        for event in (vlc.EventType.MediaPlayerEndReached, vlc.EventType.MediaPlayerEncounteredError):
+            self.player.event_manager().event_attach(event, self.end)
+        media = instance.media_new(mrl)
+        self.player.set_media(media)
+        media.release()
+        self.player.play()
+
+    def play(self, _, samples, count, pts):
+        # from a vlc thread
+        pcm = np.frombuffer(ctypes.string_at(samples, count * CHANNELS * 2), np.int16).reshape(-1, CHANNELS)
+        with self.lock:
+            self.chunks.append((pcm, time.perf_counter()))
+            self.buffered += count
+            while self.buffered - self.offset > self.limit:
+                self.buffered -= len(self.chunks.popleft()[0])
+                self.offset = 0
+
+    def flush(self, _, pts):
+        # from a vlc thread
+        with self.lock:
+            self.chunks.clear()
+            self.buffered = self.offset = 0
+
+    def end(self, _):
+        # from a vlc thread
+        self.ended = True
+
+    def read(self, frames):
+        with self.lock:
+            available = self.buffered - self.offset
+            if not self.primed and available < frames and not self.ended:
+                return np.empty((0, CHANNELS), np.int16), None
+            self.primed = True
+            arrived = self.chunks[0][1] if self.chunks else None
+            parts = []
+            while frames and self.chunks:
+                pcm = self.chunks[0][0]
+                part = pcm[self.offset:self.offset + frames]
+                parts.append(part)
+                frames -= len(part)
+                self.offset += len(part)
+                if self.offset == len(pcm):
+                    self.chunks.popleft()
+                    self.buffered -= len(pcm)
+                    self.offset = 0
+            self.done = self.ended and not self.chunks
+        pcm = np.concatenate(parts) if len(parts) > 1 else parts[0] if parts else np.empty((0, CHANNELS), np.int16)
+        return pcm, arrived
+
+    def close(self):
+        # stopping a player can block, so it's done on a thread of its own
+        threading.Thread(target=self.release, daemon=True).start()
+
+    def release(self):
+        self.player.stop()
+        self.player.release()
+
+
+class WavSink:
+    # writes the mix to a wav file instead of a sound card, e.g. to test the mixer anywhere
+
+    paced = False  # the mixer keeps time itself
+    latency = 0  # s of audio buffered after a write
+
+    def __init__(self, path):
+        self.file = wave.open(path, 'wb')
+        self.file.setnchannels(CHANNELS)
+        self.file.setsampwidth(2)
+        self.file.setframerate(RATE)
+
+    def write(self, data):
+        self.file.writeframes(data)
+
+    def close(self):
+        self.file.close()
+
+
+class WAVEFORMATEX(ctypes.Structure):
+    _fields_ = [('wFormatTag', ctypes.c_ushort), ('nChannels', ctypes.c_ushort), ('nSamplesPerSec', ctypes.c_ulong),
+                ('nAvgBytesPerSec', ctypes.c_ulong), ('nBlockAlign', ctypes.c_ushort),
+                ('wBitsPerSample', ctypes.c_ushort), ('cbSize', ctypes.c_ushort)]
+
+
+class WAVEHDR(ctypes.Structure):
+    _fields_ = [('lpData', ctypes.c_void_p), ('dwBufferLength', ctypes.c_ulong), ('dwBytesRecorded', ctypes.c_ulong),
+                ('dwUser', ctypes.c_size_t), ('dwFlags', ctypes.c_ulong), ('dwLoops', ctypes.c_ulong),
+                ('lpNext', ctypes.c_void_p), ('reserved', ctypes.c_size_t)]
+
+
+class WaveOutSink:
+    # plays the mix on a sound card through winmm's waveOut, a few buffers ahead. write blocks until one of them
+    # has played, so the sound card keeps time for the mixer. device is an output_device code as vlc uses,
+    # matched to a waveOut device by its endpoint id, or None for the default device
+
+    paced = True
+    WAVE_MAPPER = 0xFFFFFFFF
+    CALLBACK_EVENT = 0x50000
+    WHDR_DONE = 1
+    DRV_QUERYFUNCTIONINSTANCEID = 0x811
+    DRV_QUERYFUNCTIONINSTANCEIDSIZE = 0x812
+
+    def __init__(self, device, frames, buffers=4):
+        self.winmm = ctypes.windll.winmm
+        self.kernel32 = ctypes.windll.kernel32
+        self.kernel32.CreateEventW.restype = ctypes.c_void_p
+        self.latency = buffers * frames / RATE
+        size = frames * CHANNELS * 2
+        fmt = WAVEFORMATEX(1, CHANNELS, RATE, RATE * CHANNELS * 2, CHANNELS * 2, 16, 0)
+        self.event = self.kernel32.CreateEventW(None, False, False, None)
+        self.handle = ctypes.c_void_p()
+        result = self.winmm.waveOutOpen(ctypes.byref(self.handle), ctypes.c_uint(self.device_id(device)),
+                                        ctypes.byref(fmt), ctypes.c_void_p(self.event), None, self.CALLBACK_EVENT)
+        if result:
+            raise OSError(f'waveOutOpen failed with {result}')
+        self.data = [ctypes.create_string_buffer(size) for _ in range(buffers)]
+        self.headers = [WAVEHDR(ctypes.cast(data, ctypes.c_void_p), size) for data in self.data]
+        for header in self.headers:
+            self.winmm.waveOutPrepareHeader(self.handle, ctypes.byref(header), ctypes.sizeof(header))
+            header.dwFlags |= self.WHDR_DONE  # free to write to
+        self.next = 0
+
+    def device_id(self, device):
+        if not device:
+            return self.WAVE_MAPPER
+        for index in range(self.winmm.waveOutGetNumDevs()):
+            size = ctypes.c_ulong()
+            handle = ctypes.c_void_p(index)  # waveOutMessage takes a device id in place of a handle
+            self.winmm.waveOutMessage(handle, self.DRV_QUERYFUNCTIONINSTANCEIDSIZE, ctypes.byref(size), None)
+            name = ctypes.create_unicode_buffer(size.value // 2 + 1)
+            self.winmm.waveOutMessage(handle, self.DRV_QUERYFUNCTIONINSTANCEID, name, size)
+            if name.value == device:
+                return index
+        return self.WAVE_MAPPER
+
+    def write(self, data):
+        header = self.headers[self.next]
+        while not header.dwFlags & self.WHDR_DONE:
+            self.kernel32.WaitForSingleObject(ctypes.c_void_p(self.event), 100)
+        ctypes.memmove(self.data[self.next], data, len(data))
+        header.dwBufferLength = len(data)
+        self.winmm.waveOutWrite(self.handle, ctypes.byref(header), ctypes.sizeof(header))
+        self.next = (self.next + 1) % len(self.headers)
+
+    def close(self):
+        self.winmm.waveOutReset(self.handle)
+        for header in self.headers:
+            self.winmm.waveOutUnprepareHeader(self.handle, ctypes.byref(header), ctypes.sizeof(header))
+        self.winmm.waveOutClose(self.handle)
+        self.kernel32.CloseHandle(ctypes.c_void_p(self.event))
+
+
+class Mixer(threading.Thread):
+    # mixes sources into one output a buffer at a time on its own thread, each at its own gain
+    # a peak limiter keeps the sum from clipping: it drops the gain straight away and lets it back up slowly
+    # cpu is the time spent mixing each buffer, latency how long the pcm took from its source to the sink
+
+    def __init__(self, sink, frames=960):
+        super().__init__(daemon=True)
+        self.sink = sink
+        self.frames = frames
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.sources = []
+        self.limit = 1.0
+        self.running = True
+        self.cpu = Histogram()
+        self.latency = Histogram()
+
+    def add(self, source):
+        with self.lock:
+            self.sources.append(source)
+            self.wakeup.set()
+
+    def remove(self, source):
+        with self.lock:
+            if source not in self.sources:
+                return
+            self.sources.remove(source)
+        source.close()
+
+    def clear(self):
+        with self.lock:
+            sources, self.sources = self.sources, []
+        for source in sources:
+            source.close()
+
+    def close(self):
+        self.running = False
+        self.wakeup.set()
+        self.join()
+        self.clear()
+        self.sink.close()
+
+    def mix(self, sources):
+        # the next buffer as 16 bit pcm, and when the oldest of it arrived
+        began = time.perf_counter()
+        mix = np.zeros((self.frames, CHANNELS), np.float32)
+        arrived = []
+        for source in sources:
+            pcm, stamp = source.read(self.frames)
+            if len(pcm):
+                mix[:len(pcm)] += pcm * np.float32(source.gain / 32768)
+            if stamp is not None:
+                arrived.append(stamp)
+            if source.done:
+                self.remove(source)
+        peak = float(np.abs(mix).max())
+        if peak * self.limit > 1:
+            self.limit = 1 / peak
+        mix *= self.limit * 32767
+        self.limit = min(1.0, self.limit * RELEASE)
+        data = np.clip(mix, -32768, 32767).astype(np.int16).tobytes()
+        self.cpu.add(time.perf_counter() - began)
+        return data, min(arrived) if arrived else None
+
+    def run(self):
+        period = self.frames / RATE
+        deadline = time.perf_counter()
+        while self.running:
+            with self.lock:
+                sources = list(self.sources)
+                if not sources:
+                    self.wakeup.clear()
+            if not sources:
+                # nothing to play, the sink is left to run dry
+                self.wakeup.wait()
+                deadline = time.perf_counter()
+                continue
+            data, arrived = self.mix(sources)
+            self.sink.write(data)
+            now = time.perf_counter()
+            if arrived is not None:
+                self.latency.add(now - arrived + self.sink.latency)
+            if not self.sink.paced:
+                deadline = max(deadline + period, now - period)  # doesn't try to catch up on more than a buffer
+                time.sleep(max(0.0, deadline - now))
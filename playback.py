@@ -0,0 +1,225 @@
+# WinDJ - David Ragusa
+# Refer to the LICENSE file.
+
+import vlc
+import time
+import random
+import weakref
+import threading
+from instrument import Histogram
+
+
+class PlayerEvents:
+    # collects the libvlc events of the player being watched from vlc's threads, for the UI thread to take in
+    # one batch. only the latest state, time and length are kept, so nothing piles up while nobody is looking
+    # python-vlc keeps one callback per event type per player, so nothing else should attach these events
+
+    def __init__(self, playing=None):
+        self.lock = threading.Lock()
+        self.playing = playing  # called from vlc as soon as the watched player starts playing
+        self.attached = weakref.WeakSet()  # players already sending their events here
+        self.player = None
+        self.state = None  # 'playing', 'ended' or 'error' since the last batch
+        self.time = None  # ms
+        self.length = None  # ms
+        self.changed = False
+        self.settled = threading.Event()  # set once the song has started playing, ended or failed
+
+    def watch(self, player):
+        if player not in self.attached:
+            events = player.event_manager()
+            events.event_attach(vlc.EventType.MediaPlayerPlaying, self.update, player, 'state', 'playing')
+            events.event_attach(vlc.EventType.MediaPlayerEndReached, self.update, player, 'state', 'ended')
+            events.event_attach(vlc.EventType.MediaPlayerEncounteredError, self.update, player, 'state', 'error')
+            events.event_attach(vlc.EventType.MediaPlayerTimeChanged, self.time_changed, player)
+            events.event_attach(vlc.EventType.MediaPlayerLengthChanged, self.length_changed, player)
+            self.attached.add(player)
+        with self.lock:
+            self.player = player
+            self.state = self.time = self.length = None
+            self.changed = False
+        self.settled.clear()
+
+    def time_changed(self, event, player):
+        self.update(event, player, 'time', event.u.new_time)
+
+    def length_changed(self, event, player):
+        self.update(event, player, 'length', event.u.new_length)
+
+    def update(self, _, player, name, value):
+        with self.lock:
+            if player is not self.player:
+                return
+            setattr(self, name, value)
+            self.changed = True
+        if name == 'state':
+            self.settled.set()
+            if value == 'playing' and self.playing:
+                self.playing()
+
+    def reset(self):
+        # for a new song on the same player
+        with self.lock:
+            self.state = self.time = self.length = None
+            self.changed = False
+        self.settled.clear()
+
+    def take(self):
+        # (state, time, length) if anything changed since the last batch, otherwise None
+        with self.lock:
+            if not self.changed:
+                return None
+            batch = (self.state, self.time, self.length)
+            self.state = None
+            self.changed = False
+            return batch
+
+
+class PlayController:
+    # runs the play/stop intents of toggle_play one at a time, so the last one wins and no press is dropped
+    # vlc starts a song asynchronously, but a stop doesn't wait for it to - vlc may never report a stalled start
+    # (a network share that hangs, a slow stream), and stopping is synchronous anyway
+
+    def __init__(self, play, stop, is_playing):
+        self.play = play
+        self.stop = stop
+        self.is_playing = is_playing
+        self.wanted = None  # True to play, False to stop, None if nothing is waiting
+        self.starting = False
+
+    def toggle(self):
+        self.wanted = not (self.is_playing() if self.wanted is None else self.wanted)
+        self.run()
+
+    def run(self):
+        if self.wanted is None:
+            return
+        if self.starting:
+            if not self.wanted:
+                self.wanted = None
+                self.starting = False
+                self.stop()
+            return
+        wanted, self.wanted = self.wanted, None
+        if wanted and not self.is_playing():
+            self.starting = True
+            try:
+                self.play()
+            except Exception:
+                self.starting = False
+                raise
+        elif not wanted and self.is_playing():
+            self.stop()
+
+    def started(self):
+        # the song has started, failed or been stopped, so the next intent can run
+        if self.starting:
+            self.starting = False
+            self.run()
+
+
+class PlayQueue:
+    # songs to play after the current one. repeat is 'off', 'all' (finished songs go back on the end) or 'one'
+    # the next song is always decided in advance, so it can be opened before the current one ends
+
+    def __init__(self):
+        self.items = []
+        self.repeat = 'off'
+        self.shuffle = False
+        self.upcoming = None  # index of the next item once chosen
+
+    def __len__(self):
+        return len(self.items)
+
+    def add(self, entry):
+        self.items.append(entry)
+        if self.shuffle:
+            self.upcoming = None  # give the new song a chance of being next
+
+    def clear(self):
+        self.items = []
+        self.upcoming = None
+
+    def toggle_shuffle(self):
+        self.shuffle = not self.shuffle
+        self.upcoming = None
+
+    def cycle_repeat(self):
+        self.repeat = {'off': 'all', 'all': 'one', 'one': 'off'}[self.repeat]
+
+    def peek(self, current):
+        # the song that comes after current, without moving on
+        if self.repeat == 'one' and current:
+            return current
+        if not self.items:
+            return current if self.repeat == 'all' else None
+        if self.upcoming is None:
+            self.upcoming = random.randrange(len(self.items)) if self.shuffle else 0
+        return self.items[self.upcoming]
+
+    def next(self, current):
+        # moves on from current (None if nothing was playing) to the song after it
+        entry = self.peek(current)
+        if entry is None or entry is current:
+            return entry
+        self.items.pop(self.upcoming)
+        self.upcoming = None
+        if self.repeat == 'all' and current:
+            self.items.append(current)
+        return entry
+
+
+class Fader(threading.Thread):
+    # ramps player volumes on its own thread, so the steps keep time whatever the UI thread is doing
+    # each step sets the volume for the time actually elapsed, so a late step doesn't stretch the fade
+
+    def __init__(self, step=0.02):
+        super().__init__(daemon=True)
+        self.step = step
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.fades = {}  # player -> (began, seconds, start volume, end volume, called with the player when done)
+        self.lateness = Histogram()  # how long after its due time each fade reached its end volume
+
+    def fade(self, player, start, end, seconds, done=None):
+        player.audio_set_volume(start)
+        with self.lock:
+            self.fades[player] = (time.perf_counter(), seconds, start, end, done)
+            self.wakeup.set()
+
+    def cancel(self, player):
+        with self.lock:
+            self.fades.pop(player, None)
+
+    def finish(self):
+        # ends every fade now, calling their done callbacks
+        with self.lock:
+            fades, self.fades = self.fades, {}
+        for player, (_, _, _, end, done) in fades.items():
+            player.audio_set_volume(end)
+            if done:
+                done(player)
+
+    def run(self):
+        while True:
+            self.wakeup.wait()
+            with self.lock:
+                if not self.fades:
+                    self.wakeup.clear()
+                    continue
+                fades = list(self.fades.items())
+            now = time.perf_counter()
+            for player, fade in fades:
+                began, seconds, start, end, done = fade
+                progress = min(1.0, (now - began) / seconds)
+                with self.lock:
+                    if self.fades.get(player) is not fade:
+                        continue  # cancelled or replaced meanwhile
+                    player.audio_set_volume(round(start + (end - start) * progress))
+                    if progress == 1.0:
+                        del self.fades[player]
+                if progress == 1.0:
+                    self.lateness.add(now - began - seconds)
+                    if done:
+                        done(player)
+            time.sleep(self.step)
@@ -0,0 +1,74 @@
+# WinDJ - David Ragusa
+# Refer to the LICENSE file.
+
+import vlc
+import queue
+import threading
+from collections import OrderedDict
+
+
+class Prebuffer:
+    # media players opened paused at the start of songs likely to be played next, so playing one only unpauses it
+    # kept in a small lru by path. stopping a player can block, so evicted ones are released on a background thread
+
+    def __init__(self, instance, size, setup=None):
+        self.instance = instance
+        self.size = size
+        self.setup = setup  # called with each new player before it opens anything
+        self.players = OrderedDict()  # path -> player
+        self.ready = set()  # paths whose players have opened and paused
+        self.lock = threading.Lock()
+        self.released = queue.Queue()
+        threading.Thread(target=self.stop_released, daemon=True).start()
+
+    def prepare(self, path, mrl, options=()):
+        if path in self.players:
+            self.players.move_to_end(path)
+            return
+        player = self.instance.media_player_new()
+        if self.setup:
+            self.setup(player)
+        media = self.instance.media_new(mrl)
+        media.add_option(':start-paused')
+        for option in options:
+            media.add_option(option)
+        player.set_media(media)
+        media.release()
+        player.event_manager().event_attach(vlc.EventType.MediaPlayerPaused, lambda _: self.opened(path, player))
+        self.players[path] = player
+        player.play()
+        while len(self.players) > self.size:
+            self.discard(*self.players.popitem(last=False))
+
+    def opened(self, path, player):
+        # from a vlc event thread
+        with self.lock:
+            if self.players.get(path) is player:
+                self.ready.add(path)
+
+    def take(self, path):
+        # the player for path if it's ready to unpause, otherwise None
+        with self.lock:
+            if path not in self.ready:
+                return None
+            self.ready.discard(path)
+            return self.players.pop(path)
+
+    def discard(self, path, player):
+        with self.lock:
+            self.ready.discard(path)
+        self.release(player)
+
+    def release(self, player):
+        # also used for players handed out by take() once they're finished with
+        self.released.put(player)
+
+    def clear(self):
+        while self.players:
+            self.discard(*self.players.popitem())
+
+    def stop_released(self):
+        while True:
+            player = self.released.get()
+            player.stop()
+            player.release()
@@ -0,0 +1,172 @@
+# WinDJ - David Ragusa
+# Refer to the LICENSE file.
+
+import queue
+import threading
+import unicodedata
+from array import array
+from collections import defaultdict
+
+PAD = '\0\0'  # so every one and two character substring starts some trigram
+
+# fuzzy scoring
+BOUNDARIES = frozenset(' -_.,()[]&\'')
+MATCH = 1
+CONSECUTIVE = 2
+BOUNDARY = 3
+# per query character for an exact match, more than a scattered match can get for any character
+SUBSTRING = MATCH + CONSECUTIVE + BOUNDARY + 1
+TYPO = 3
+TYPO_MIN_LENGTH = 4  # shorter queries must match every character
+
+CHUNK = 4096  # songs searched between checks for a newer search
+
+
+def normalize(text):
+    # casefolded with accents stripped, so 'Beyoncé' is found by 'beyonce'
+    if text.isascii():
+        return text.lower()
+    return ''.join(char for char in unicodedata.normalize('NFKD', text.casefold()) if not unicodedata.combining(char))
+
+
+def fuzzy_score(query, key):
+    # subsequence match with bonuses for consecutive characters and word starts, allowing one missed
+    # character for longer queries. None if it doesn't match
+    found = key.find(query)
+    if found >= 0:
+        return SUBSTRING * len(query) + (BOUNDARY if found == 0 or key[found - 1] in BOUNDARIES else 0)
+    score, pos, prev = 0, 0, -2
+    typos = 0 if len(query) < TYPO_MIN_LENGTH else 1
+    for char in query:
+        found = key.find(char, pos)
+        if found < 0:
+            if not typos:
+                return None
+            typos -= 1
+            score -= TYPO
+            continue
+        score += MATCH
+        if found == prev + 1:
+            score += CONSECUTIVE
+        if found == 0 or key[found - 1] in BOUNDARIES:
+            score += BOUNDARY
+        prev, pos = found, found + 1
+    return score
+
+
+def scan(text, keys, indices, cancelled=None):
+    # indices of the songs containing text, in order. None if cancelled partway through
+    found = array('I')
+    for start in range(0, len(indices), CHUNK):
+        if cancelled and cancelled():
+            return None
+        found.extend(index for index in indices[start:start + CHUNK] if text in keys[index])
+    return found
+
+
+def rank(query, keys, indices, cancelled=None):
+    # indices of the songs matching query, best first. None if cancelled partway through
+    scored = []
+    for start in range(0, len(indices), CHUNK):
+        if cancelled and cancelled():
+            return None
+        for index in indices[start:start + CHUNK]:
+            score = fuzzy_score(query, keys[index])
+            if score is not None:
+                scored.append((-score, index))
+    scored.sort()
+    return array('I', (index for _, index in scored))
+
+
+def narrows(previous, query, fuzzy):
+    # whether the results for query are always among the results for previous,
+    # which stops being true for fuzzy search once the query gets long enough to allow a typo
+    if not query.startswith(previous):
+        return False
+    return not fuzzy or len(previous) >= TYPO_MIN_LENGTH or len(query) < TYPO_MIN_LENGTH
+
+
+class TrigramIndex:
+    # inverted index from trigrams of the search keys to song ids
+    # queries of three or more characters only check the songs in their rarest trigram's posting list,
+    # shorter ones go through the prefix table of trigrams starting with them
+
+    def __init__(self, ids=(), keys=()):
+        # bulk build from the songs already loaded, individual songs go through add()
+        postings = defaultdict(list)
+        for song_id, key in zip(ids, keys):
+            padded = key + PAD
+            for trigram in set(map(''.join, zip(padded, padded[1:], padded[2:]))):
+                postings[trigram].append(song_id)
+        self.postings = {trigram: array('I', posting) for trigram, posting in postings.items()}  # trigram -> ids
+        self.prefixes = {}  # one or two character prefix -> trigrams starting with it
+        for trigram in self.postings:
+            self.prefixes.setdefault(trigram[0], []).append(trigram)
+            self.prefixes.setdefault(trigram[:2], []).append(trigram)
+
+    def add(self, song_id, key):
+        padded = key + PAD
+        for trigram in {padded[i:i + 3] for i in range(len(key))}:
+            posting = self.postings.get(trigram)
+            if posting is None:
+                posting = self.postings[trigram] = array('I')
+                self.prefixes.setdefault(trigram[0], []).append(trigram)
+                self.prefixes.setdefault(trigram[:2], []).append(trigram)
+            posting.append(song_id)
+
+    def candidates(self, text, limit):
+        # song ids that may contain text - deleted songs are left in and skipped by the caller
+        # None if there would be more than limit, as then it's quicker to scan every song
+        if len(text) >= 3:
+            postings = []
+            for trigram in {text[i:i + 3] for i in range(len(text) - 2)}:
+                if trigram not in self.postings:
+                    return ()
+                postings.append(self.postings[trigram])
+            return min(postings, key=len)
+        trigrams = self.prefixes.get(text, ())
+        if sum(len(self.postings[trigram]) for trigram in trigrams) > limit:
+            return None
+        candidates = set()
+        for trigram in trigrams:
+            candidates.update(self.postings[trigram])
+        return candidates
+
+
+class SearchWorker(threading.Thread):
+    # runs searches off the UI thread. every search gets a generation number and only the newest one
+    # is worked on - older ones are skipped, or abandoned partway through once a newer one comes in
+    # results go to self.results as (generation, query, results, version), with results None
+    # if the songs changed underneath the search
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.jobs = queue.Queue()
+        self.results = queue.Queue()
+        self.generation = 0
+
+    def submit(self, generation, query, base, fuzzy, version):
+        self.generation = generation
+        self.jobs.put((generation, query, base, fuzzy, version))
+
+    def cancel(self):
+        self.generation = None
+
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            while not self.jobs.empty():
+                job = self.jobs.get()
+            generation, query, base, fuzzy, version = job
+            if generation != self.generation:
+                continue
+
+            def cancelled():
+                return generation != self.generation
+
+            try:
+                results = base.fuzzy(query, cancelled) if fuzzy else base.search(query, cancelled)
+            except IndexError:
+                results = None  # a song was deleted mid-search, the version check has it searched again
+            if not cancelled():
+                self.results.put((generation, query, results, version))
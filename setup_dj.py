@@ -9,7 +9,9 @@ os.environ['TK_LIBRARY'] = os.path.join(PYTHON_INSTALL_DIR, 'tcl', 'tk8.6')
 build_exe_options = {
     'build_exe': 'setup_dj',
     'packages': [
-        'os', 'queue', 'threading', 'pyWinhook', 'tkinter', 'multiprocessing', 'configparser', 'helper'
+        'os', 'queue', 'threading', 'pyWinhook', 'tkinter', 'multiprocessing', 'configparser', 'sqlite3',
+        'helper', 'library', 'watcher', 'metadata', 'search', 'widgets', 'instrument', 'keymap', 'prebuffer', 'playback',
+        'mixer', 'soundboard', 'analysis', 'snapshot'
     ],
     'include_files': [
         'favicon.ico',
@@ -9,7 +9,7 @@ os.environ['TK_LIBRARY'] = os.path.join(PYTHON_INSTALL_DIR, 'tcl', 'tk8.6')
 build_exe_options = {
     'build_exe': 'setup_helper',
     'packages': [
-        'os', 'sys', 'queue', 'threading', 'pyWinhook', 'tkinter', 'multiprocessing'
+        'os', 'sys', 'queue', 'threading', 'pyWinhook', 'tkinter', 'multiprocessing', 'instrument', 'keymap'
     ],
     'include_files': [
         'favicon.ico',
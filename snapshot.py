@@ -0,0 +1,186 @@
+# WinDJ - David Ragusa
+# Refer to the LICENSE file.
+
+import os
+import json
+import mmap
+import queue
+import struct
+import logging
+import threading
+from array import array
+from bisect import bisect_right
+from itertools import accumulate
+from library import SongList
+
+MAGIC = b'WDJS'
+VERSION = 1
+HEADER = struct.Struct('<4sII')  # magic, version, length of the json layout that follows
+
+log = logging.getLogger('windj')
+
+
+def align(size):
+    return -size % 4
+
+
+class StringTable:
+    # strings stored back to back in a mapped snapshot, each only decoded when it's looked at
+    # laid out as count + 1 uint32 offsets, then the utf-8 strings each followed by a \0
+
+    def __init__(self, buffer, offset, count):
+        self.buffer = buffer
+        self.count = count
+        self.offsets = memoryview(buffer)[offset:offset + 4 * (count + 1)].cast('I')
+        self.start = offset + 4 * (count + 1)
+        self.end = self.start + self.offsets[count]
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError('string index out of range')
+        begin, end = self.start + self.offsets[index], self.start + self.offsets[index + 1] - 1
+        return self.buffer[begin:end].decode('utf-8', 'surrogatepass')
+
+    def __iter__(self):
+        return iter(self.buffer[self.start:self.end].decode('utf-8', 'surrogatepass').split('\0')[:-1])
+
+    def containing(self, text):
+        # indices of the strings containing text, found in the mapped bytes rather than by decoding every one
+        # the \0 after each string means a match never runs on into the next
+        if not text:
+            return array('I', range(self.count))
+        needle = text.encode('utf-8', 'surrogatepass')
+        found = array('I')
+        pos = self.buffer.find(needle, self.start, self.end)
+        while pos != -1:
+            index = bisect_right(self.offsets, pos - self.start) - 1
+            found.append(index)
+            pos = self.buffer.find(needle, self.start + self.offsets[index + 1], self.end)
+        return found
+
+
+def sections(songs):
+    # what a snapshot holds of a song list - copied, so it can be written out while the list changes
+    return {
+        'folders': list(songs.folders),
+        'roots': array('I', (root for root, _ in songs.folder_keys)),
+        'parts': ['/'.join(parts) for _, parts in songs.folder_keys],
+        'folder_ids': array('I', songs.folder_ids),
+        'filenames': list(songs.filenames),
+        'displays': list(songs.displays),
+        'search_keys': list(songs.search_keys)
+    }
+
+
+def write(path, key, sequence, sections):
+    # written alongside and then moved over path, so a snapshot is never seen half written
+    layout, chunks, size = {}, [], 0
+    for name, values in sections.items():
+        if isinstance(values, array):
+            data = values.tobytes()
+        else:
+            encoded = [value.encode('utf-8', 'surrogatepass') + b'\0' for value in values]
+            data = array('I', accumulate((len(value) for value in encoded), initial=0)).tobytes() + b''.join(encoded)
+        layout[name] = (size, len(values))
+        chunks.append(data + b'\0' * align(len(data)))
+        size += len(chunks[-1])
+    header = json.dumps({'key': key, 'sequence': sequence, 'size': size, 'sections': layout}).encode()
+    header += b' ' * align(HEADER.size + len(header))
+    with open(path + '.tmp', 'wb') as file:
+        file.write(HEADER.pack(MAGIC, VERSION, len(header)))
+        file.write(header)
+        file.writelines(chunks)
+    os.replace(path + '.tmp', path)
+
+
+def map_file(path, key):
+    # (mapped file, its header), None if there's no usable snapshot for key at path
+    try:
+        with open(path, 'rb') as file:
+            buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, length = HEADER.unpack_from(buffer)
+        if magic != MAGIC or version != VERSION:
+            return None
+        header = json.loads(buffer[HEADER.size:HEADER.size + length])
+    except (OSError, ValueError, struct.error):
+        return None
+    header['body'] = HEADER.size + length
+    if header['key'] != key or len(buffer) != header['body'] + header['size']:
+        return None
+    return buffer, header
+
+
+def read(buffer, header):
+    # a song list straight from the mapped file, its strings decoded as they're looked at
+    layout = {name: (header['body'] + offset, count) for name, (offset, count) in header['sections'].items()}
+
+    def strings(name):
+        return StringTable(buffer, *layout[name])
+
+    def numbers(name):
+        offset, count = layout[name]
+        return memoryview(buffer)[offset:offset + 4 * count].cast('I')
+
+    songs = SongList()
+    songs.folders = list(strings('folders'))
+    songs.folder_keys = [(root, tuple(parts.split('/')) if parts else ())
+                         for root, parts in zip(numbers('roots'), strings('parts'))]
+    songs.folder_index = {folder: folder_id for folder_id, folder in enumerate(songs.folders)}
+    songs.folder_ids = numbers('folder_ids')
+    songs.filenames = strings('filenames')
+    songs.displays = strings('displays')
+    songs.search_keys = strings('search_keys')
+    songs.ids = array('I', range(len(songs.filenames)))
+    songs.next_id = len(songs.filenames)
+    songs.id_positions = None
+    return songs
+
+
+def open_latest(base, key):
+    # (song list or None, path the next snapshot goes to, its sequence number)
+    # snapshots alternate between two files, as the one that's mapped can't be replaced on windows
+    paths = (base + '.0', base + '.1')
+    found = [(mapped[1]['sequence'], path, mapped) for path, mapped in ((path, map_file(path, key)) for path in paths)
+             if mapped]
+    if not found:
+        return None, paths[0], 1
+    sequence, path, mapped = max(found, key=lambda snapshot: snapshot[0])
+    return read(*mapped), paths[1 - paths.index(path)], sequence + 1
+
+
+def unchanged(snapshot, songs):
+    # whether a freshly built song list has the same songs in the same places as one read from a snapshot
+    return (len(snapshot) == len(songs) and snapshot.folders == songs.folders and
+            array('I', snapshot.folder_ids) == songs.folder_ids and list(snapshot.filenames) == songs.filenames and
+            list(snapshot.displays) == songs.displays)
+
+
+class SnapshotWriter(threading.Thread):
+    # writes snapshots of the song list on its own thread - if several are waiting only the latest is written
+
+    def __init__(self, path, key, sequence):
+        super().__init__(daemon=True)
+        self.path = path
+        self.key = key
+        self.sequence = sequence
+        self.pending = queue.Queue()
+
+    def save(self, songs):
+        # from the thread that changes songs
+        self.pending.put(sections(songs))
+
+    def run(self):
+        while True:
+            latest = self.pending.get()
+            while not self.pending.empty():
+                latest = self.pending.get()
+            try:
+                write(self.path, self.key, self.sequence, latest)
+                self.sequence += 1
+            except OSError as e:
+                log.warning('could not write the song list snapshot: %s', e)
@@ -0,0 +1,104 @@
+# WinDJ - David Ragusa
+# Refer to the LICENSE file.
+
+import weakref
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from mixer import ClipSource, CHANNELS, decoded, np
+
+log = logging.getLogger('windj')
+
+
+def decode(instance, path):
+    # the whole clip as 16 bit pcm (frames, channels), or None if vlc can't play it
+    try:
+        with decoded(instance, path) as file:
+            if file is None:
+                return None
+            return np.frombuffer(file.readframes(file.getnframes()), np.int16).reshape(-1, CHANNELS)
+    except OSError:
+        return None
+
+
+class ClipCache:
+    # decoded clips by path, the least recently played dropped first once they take up more than limit bytes
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.clips = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, path):
+        with self.lock:
+            pcm = self.clips.get(path)
+            if pcm is not None:
+                self.clips.move_to_end(path)
+            return pcm
+
+    def put(self, path, pcm):
+        with self.lock:
+            if path in self.clips:
+                self.size -= self.clips.pop(path).nbytes
+            self.clips[path] = pcm
+            self.size += pcm.nbytes
+            # the newest clip is always kept, even if it's bigger than the limit on its own
+            while self.size > self.limit and len(self.clips) > 1:
+                self.size -= self.clips.popitem(last=False)[1].nbytes
+
+
+class Soundboard:
+    # clips bound to keys, decoded into memory up front so pressing one plays it straight from ram through the mixer
+    # policy is 'restart' (a clip that's still playing starts again) or 'overlap' (it plays again on top)
+    # a clip that's been evicted is decoded again in the background and plays once it's ready
+
+    def __init__(self, instance, mixer, paths, limit, policy='restart', workers=2):
+        self.instance = instance
+        self.mixer = mixer
+        self.policy = policy
+        self.cache = ClipCache(limit)
+        self.lock = threading.Lock()
+        self.pending = {}  # path -> future of its decode
+        self.playing = weakref.WeakValueDictionary()  # path -> its latest source, until the mixer drops it
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        for path in paths:
+            self.load(path)
+
+    def load(self, path):
+        with self.lock:
+            if path not in self.pending:
+                self.pending[path] = self.pool.submit(self.decode, path)
+            return self.pending[path]
+
+    def decode(self, path):
+        # on a pool thread
+        pcm = decode(self.instance, path)
+        if pcm is None:
+            log.warning('could not decode clip %s', path)
+        else:
+            self.cache.put(path, pcm)
+        with self.lock:
+            del self.pending[path]
+        return pcm
+
+    def play(self, path, gain=1.0):
+        pcm = self.cache.get(path)
+        if pcm is not None:
+            self.start(path, pcm, gain)
+            return
+        self.load(path).add_done_callback(lambda future: future.result() is not None and
+                                          self.start(path, future.result(), gain))
+
+    def start(self, path, pcm, gain):
+        source = ClipSource(pcm, gain)
+        with self.lock:
+            previous = self.playing.get(path)
+            self.playing[path] = source
+        if previous is not None and self.policy == 'restart':
+            self.mixer.remove(previous)
+        self.mixer.add(source)
+
+    def close(self):
+        self.pool.shutdown(wait=False)
@@ -0,0 +1,156 @@
+# WinDJ - David Ragusa
+# Refer to the LICENSE file.
+
+# a stand-in for the parts of python-vlc WinDJ uses, for headless tests and benchmarks without libvlc
+# nothing happens on its own - tests fire a player's events themselves, e.g. to say a song has started
+# install it before importing anything that imports vlc:  sys.modules['vlc'] = stub_vlc
+
+from types import SimpleNamespace
+
+
+class EventType:
+    MediaParsedChanged = 'MediaParsedChanged'
+    MediaPlayerPlaying = 'MediaPlayerPlaying'
+    MediaPlayerPaused = 'MediaPlayerPaused'
+    MediaPlayerEndReached = 'MediaPlayerEndReached'
+    MediaPlayerEncounteredError = 'MediaPlayerEncounteredError'
+    MediaPlayerTimeChanged = 'MediaPlayerTimeChanged'
+    MediaPlayerLengthChanged = 'MediaPlayerLengthChanged'
+
+
+class MediaParseFlag:
+    local = 0
+
+
+class Meta:
+    Title = 0
+    Artist = 1
+    Album = 2
+
+
+class EventManager:
+    # like python-vlc, one callback per event type
+
+    def __init__(self):
+        self.callbacks = {}
+
+    def event_attach(self, event_type, callback, *args):
+        self.callbacks[event_type] = (callback, args)
+
+    def event_detach(self, event_type):
+        self.callbacks.pop(event_type, None)
+
+    def fire(self, event_type, **u):
+        if event_type in self.callbacks:
+            callback, args = self.callbacks[event_type]
+            callback(SimpleNamespace(type=event_type, u=SimpleNamespace(**u)), *args)
+
+
+class Media:
+
+    def __init__(self, mrl):
+        self.mrl = mrl
+        self.options = []
+        self.events = EventManager()
+
+    def event_manager(self):
+        return self.events
+
+    def add_option(self, option):
+        self.options.append(option)
+
+    def get_mrl(self):
+        return self.mrl
+
+    def parse_with_options(self, flags, timeout):
+        self.events.fire(EventType.MediaParsedChanged)
+
+    def get_duration(self):
+        return -1
+
+    def get_meta(self, meta):
+        return None
+
+    def release(self):
+        pass
+
+
+class MediaPlayer:
+    made = 0  # by any instance, so tests can tell players are being reused
+
+    def __init__(self):
+        self.media = None
+        self.volume = 100
+        self.muted = False
+        self.playing = False
+        self.paused = False
+        self.device = None
+        self.plays = 0
+        self.events = EventManager()
+
+    def event_manager(self):
+        return self.events
+
+    def set_media(self, media):
+        self.media = media
+
+    def get_media(self):
+        return self.media
+
+    def play(self):
+        self.playing = True
+        self.paused = False
+        self.plays += 1
+        return 0
+
+    def set_pause(self, paused):
+        self.paused = bool(paused)
+
+    def pause(self):
+        self.paused = not self.paused
+
+    def stop(self):
+        self.playing = False
+        self.paused = False
+
+    def audio_set_volume(self, volume):
+        self.volume = volume
+
+    def audio_get_volume(self):
+        return self.volume
+
+    def audio_set_mute(self, muted):
+        self.muted = bool(muted)
+
+    def audio_output_device_set(self, module, device):
+        self.device = device
+
+    def audio_output_device_get(self):
+        return self.device
+
+    def get_time(self):
+        return 0
+
+    def get_length(self):
+        return 0
+
+    def release(self):
+        pass
+
+
+class Instance:
+    made = 0
+
+    def __init__(self, *args):
+        Instance.made += 1
+        self.args = args
+
+    def media_new(self, mrl):
+        return Media(mrl)
+
+    def media_player_new(self):
+        MediaPlayer.made += 1
+        return MediaPlayer()
+
+    def release(self):
+        pass
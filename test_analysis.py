@@ -0,0 +1,81 @@
+# WinDJ - David Ragusa
+# Refer to the LICENSE file.
+
+# checks of the silence search on synthetic songs, decoded from wav files written here instead of by vlc
+# run with python -m unittest test_analysis
+
+import os
+import sys
+import wave
+import tempfile
+import unittest
+import stub_vlc
+from contextlib import contextmanager
+
+sys.modules['vlc'] = stub_vlc
+
+import analysis  # noqa: E402
+from mixer import RATE, CHANNELS, np  # noqa: E402
+
+
+def song(seconds, sound_from, sound_to, level=8000):
+    # pcm of a song that's silent apart from a tone between sound_from and sound_to (s)
+    pcm = np.zeros((int(seconds * RATE), CHANNELS), np.int16)
+    pcm[int(sound_from * RATE):int(sound_to * RATE)] = level
+    return pcm
+
+
+@unittest.skipIf(np is None, 'needs numpy')
+class TestSilence(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.pcm = None
+        self.decoded, self.song_length = analysis.decoded, analysis.song_length
+        analysis.decoded = self.decode
+        analysis.song_length = lambda path: len(self.pcm) / RATE
+
+    def tearDown(self):
+        analysis.decoded, analysis.song_length = self.decoded, self.song_length
+        self.folder.cleanup()
+
+    @contextmanager
+    def decode(self, instance, path, options=(), **kwargs):
+        # what vlc's transcode would give for the :stop-time or :start-time option
+        name, value = options[0][1:].split('=')
+        frames = int(float(value) * RATE)
+        pcm = self.pcm[:frames] if name == 'stop-time' else self.pcm[frames:]
+        wav = os.path.join(self.folder.name, 'song.wav')
+        with wave.open(wav, 'wb') as file:
+            file.setnchannels(CHANNELS)
+            file.setsampwidth(2)
+            file.setframerate(RATE)
+            file.writeframes(pcm.tobytes())
+        with wave.open(wav) as file:
+            yield file
+
+    def test_trimmed(self):
+        self.pcm = song(30, 2, 27)
+        start, end = analysis.measure_silence('song.mp3')
+        self.assertAlmostEqual(start, 1990, delta=1)
+        self.assertAlmostEqual(end, 27010, delta=1)
+
+    def test_quiet_intro_and_outro(self):
+        # no sound within 10 s of either end, so neither is trimmed rather than cutting 10 s off the song
+        self.pcm = song(40, 12, 28)
+        self.assertEqual(analysis.measure_silence('song.mp3'), (0, None))
+
+    def test_silent(self):
+        self.pcm = song(5, 0, 0)
+        self.assertEqual(analysis.measure_silence('song.mp3'), (0, None))
+        self.assertIsNone(analysis.first_sound(self.pcm))
+
+    def test_negative_peak(self):
+        # -32768 on its own counts as sound
+        self.pcm = song(20, 0, 0)
+        self.pcm[RATE * 3] = (-32768, 0)
+        self.assertEqual(analysis.first_sound(self.pcm), RATE * 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
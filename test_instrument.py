@@ -0,0 +1,72 @@
+# WinDJ - David Ragusa
+# Refer to the LICENSE file.
+
+# headless checks of the hotkey to audio latency histograms, fed by a stub player's events
+# run with python -m unittest test_instrument
+
+import sys
+import time
+import unittest
+import stub_vlc
+
+sys.modules['vlc'] = stub_vlc
+
+from instrument import StageRecorder  # noqa: E402
+from playback import PlayerEvents  # noqa: E402
+
+STAGES = ('hook', 'dispatch', 'play', 'player_play', 'playing')
+
+
+class TestLatency(unittest.TestCase):
+
+    def setUp(self):
+        self.latency = StageRecorder(STAGES)
+        self.events = PlayerEvents(playing=lambda: self.latency.mark('playing'))
+        self.player = stub_vlc.Instance().media_player_new()
+        self.events.watch(self.player)
+
+    def press(self, hooked):
+        # what handle_button and start() mark on the way to vlc, then vlc reporting the song playing
+        self.latency.begin(hook=hooked, dispatch=hooked + 0.0004, play=hooked + 0.002)
+        self.latency.mark('player_play', hooked + 0.003)
+        self.player.play()
+        self.player.event_manager().fire(stub_vlc.EventType.MediaPlayerPlaying)
+
+    def test_stages(self):
+        for _ in range(100):
+            self.press(time.perf_counter())
+        for stage in STAGES[1:]:
+            self.assertEqual(len(self.latency.histograms[stage].samples), 100, stage)
+        dispatch = self.latency.histograms['dispatch']
+        self.assertAlmostEqual(dispatch.percentiles(50)[50], 0.0004)
+        self.assertEqual(dict(dispatch.buckets())['<=0.5ms'], 100)
+        self.assertIsNone(self.latency.trace)  # reaching playing ends the trace
+        self.assertIn('hook -> playing: n=100', self.latency.dump())
+
+    def test_unhooked_play(self):
+        # played by mouse, so there's no hotkey to measure from
+        self.latency.begin(play=time.perf_counter())
+        self.player.event_manager().fire(stub_vlc.EventType.MediaPlayerPlaying)
+        self.assertFalse(any(histogram.samples for histogram in self.latency.histograms.values()))
+
+    def test_other_player(self):
+        # only the player being watched ends the trace, not a prebuffered one opening
+        self.latency.begin(hook=time.perf_counter())
+        other = stub_vlc.Instance().media_player_new()
+        self.events.watch(other)
+        self.events.watch(self.player)
+        other.event_manager().fire(stub_vlc.EventType.MediaPlayerPlaying)
+        self.assertFalse(self.latency.histograms['playing'].samples)
+        self.player.event_manager().fire(stub_vlc.EventType.MediaPlayerPlaying)
+        self.assertEqual(len(self.latency.histograms['playing'].samples), 1)
+
+    def test_cancelled(self):
+        # stopped before vlc started the song
+        self.latency.begin(hook=time.perf_counter())
+        self.latency.cancel()
+        self.player.event_manager().fire(stub_vlc.EventType.MediaPlayerPlaying)
+        self.assertFalse(self.latency.histograms['playing'].samples)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+# WinDJ - David Ragusa
+# Refer to the LICENSE file.
+
+# checks of scanning folder trees with links in them, run with python -m unittest test_library
+
+import os
+import tempfile
+import unittest
+from library import Library
+from watcher import FolderWatcher
+
+
+def touch(*parts):
+    with open(os.path.join(*parts), 'w'):
+        pass
+
+
+class TestLinks(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.music = os.path.join(self.folder.name, 'm')
+        os.makedirs(os.path.join(self.music, 'album'))
+        touch(self.music, 'a.mp3')
+        touch(self.music, 'album', 'b.mp3')
+        try:
+            # a link back up the tree, which the scan would otherwise follow until the os gives up
+            os.symlink(self.music, os.path.join(self.music, 'album', 'loop'), target_is_directory=True)
+        except (OSError, NotImplementedError):
+            self.skipTest('symlinks need more privileges here')
+        self.library = Library(os.path.join(self.folder.name, 'library.db'), [self.music])
+
+    def tearDown(self):
+        self.library.close()
+        self.folder.cleanup()
+
+    def filenames(self):
+        return sorted(song['filename'] for song in self.library.songs())
+
+    def test_loop(self):
+        stats = self.library.rescan()
+        self.assertEqual(stats.dirs, 2)
+        self.assertEqual(self.filenames(), ['a.mp3', 'b.mp3'])
+        # and again, with the folders now stored
+        self.library.rescan()
+        self.assertEqual(self.filenames(), ['a.mp3', 'b.mp3'])
+
+    def test_linked_folder(self):
+        # a link to a folder outside the library is followed, once however many links lead to it
+        other = os.path.join(self.folder.name, 'other')
+        os.mkdir(other)
+        touch(other, 'c.mp3')
+        os.symlink(other, os.path.join(self.music, 'linked'), target_is_directory=True)
+        os.symlink(other, os.path.join(self.music, 'album', 'linked again'), target_is_directory=True)
+        self.library.rescan()
+        self.assertEqual(self.filenames(), ['a.mp3', 'b.mp3', 'c.mp3'])
+
+    def test_watcher(self):
+        # a folder changing doesn't lead the watcher round the loop either
+        self.library.rescan()
+        watcher = FolderWatcher([], None, 1)
+        watcher.watch(self.library.depths())
+        os.mkdir(os.path.join(self.music, 'new'))
+        touch(self.music, 'new', 'd.mp3')
+        results = watcher.relist({self.music, os.path.join(self.music, 'album')})
+        self.assertEqual(sorted(path for path, *_ in results),
+                         sorted([self.music, os.path.join(self.music, 'album'), os.path.join(self.music, 'new')]))
+        self.library.apply(results)
+        self.assertEqual(self.filenames(), ['a.mp3', 'b.mp3', 'd.mp3'])
+
+
+if __name__ == '__main__':
+    unittest.main()
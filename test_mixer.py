@@ -0,0 +1,96 @@
+# WinDJ - David Ragusa
+# Refer to the LICENSE file.
+
+# checks of the mixer mixing clips into a wav file, so it runs anywhere. run with python -m unittest test_mixer
+
+import os
+import sys
+import wave
+import tempfile
+import unittest
+import stub_vlc
+
+sys.modules['vlc'] = stub_vlc
+
+from mixer import Mixer, Source, ClipSource, WavSink, CHANNELS, np  # noqa: E402
+
+FRAMES = 960
+
+
+def clip(level, buffers):
+    # a constant level in both channels, buffers long
+    return np.full((FRAMES * buffers, CHANNELS), level, np.int16)
+
+
+@unittest.skipIf(np is None, 'needs numpy')
+class TestMixer(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.wav = os.path.join(self.folder.name, 'mix.wav')
+        self.mixer = Mixer(WavSink(self.wav), FRAMES)
+        self.closed = []
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def add(self, pcm, gain=1.0):
+        source = ClipSource(pcm, gain)
+        source.close = lambda: self.closed.append(source)
+        self.mixer.add(source)
+        return source
+
+    def mix(self, buffers):
+        # what the mixer thread does for each buffer, then the wav it wrote as (frames, channels)
+        for _ in range(buffers):
+            with self.mixer.lock:
+                sources = list(self.mixer.sources)
+            data, _ = self.mixer.mix(sources)
+            self.mixer.sink.write(data)
+        self.mixer.sink.close()
+        with wave.open(self.wav) as file:
+            return np.frombuffer(file.readframes(file.getnframes()), np.int16).reshape(-1, CHANNELS)
+
+    def test_gain(self):
+        self.add(clip(8000, 2), gain=0.5)
+        self.add(clip(-2000, 2), gain=2.0)
+        out = self.mix(2)
+        self.assertEqual(out.shape, (FRAMES * 2, CHANNELS))
+        np.testing.assert_allclose(out, 8000 * 0.5 - 2000 * 2.0, atol=1)
+
+    def test_limiter(self):
+        # two loud sources sum far past int16: the peak is brought down to full scale rather than wrapping
+        self.add(clip(30000, 4))
+        self.add(clip(30000, 4))
+        out = self.mix(4)
+        self.assertTrue((out > 0).all())  # wrapping would have made it negative
+        self.assertGreaterEqual(int(out[0, 0]), 32760)  # full scale, give or take rounding
+        self.assertGreaterEqual(int(out.min()), 32000)
+
+    def test_limiter_recovers(self):
+        self.add(clip(30000, 1))
+        self.add(clip(30000, 1))
+        self.add(clip(1000, 400))
+        out = self.mix(400)
+        self.assertGreaterEqual(int(out[:FRAMES].max()), 32760)
+        self.assertLess(int(out[FRAMES, 0]), 600)  # held down after the peak
+        np.testing.assert_allclose(out[-FRAMES:], 1000, atol=1)  # let back up to unity
+
+    def test_finished_dropped(self):
+        short = self.add(clip(1000, 1))
+        long = self.add(clip(1000, 3))
+        partial = self.add(clip(1000, 2)[:FRAMES + 100])
+        out = self.mix(3)
+        self.assertEqual(self.mixer.sources, [])
+        self.assertEqual(self.closed, [short, partial, long])
+        np.testing.assert_allclose(out[:FRAMES], 3000, atol=1)
+        np.testing.assert_allclose(out[FRAMES:FRAMES + 100], 2000, atol=1)
+        np.testing.assert_allclose(out[FRAMES + 100:], 1000, atol=1)
+
+    def test_abstract_source(self):
+        with self.assertRaises(TypeError):
+            Source()
+
+
+if __name__ == '__main__':
+    unittest.main()
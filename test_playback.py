@@ -0,0 +1,106 @@
+# WinDJ - David Ragusa
+# Refer to the LICENSE file.
+
+# stress tests of toggle_play against a stub player, run with python -m unittest test_playback
+
+import sys
+import random
+import unittest
+import stub_vlc
+
+sys.modules['vlc'] = stub_vlc
+
+from playback import PlayerEvents, PlayController  # noqa: E402
+
+RUNS = 200
+TICKS = 5000
+
+
+class StubApp:
+    # the parts of WinDJ that PlayController drives, with a stub player that takes a random number of ticks
+    # (or forever) to report a song playing. wait_for_start's 10 ms poll is one tick
+
+    def __init__(self, rng):
+        self.rng = rng
+        self.player = stub_vlc.MediaPlayer()
+        self.events = PlayerEvents()
+        self.controller = PlayController(self.play, self.stop, lambda: self.playing)
+        self.playing = False
+        self.settle_in = None  # ticks until vlc reports the song playing, None if it never will
+        self.waiting = False  # wait_for_start is polling
+        self.plays = 0
+        self.overlaps = 0
+
+    def play(self):
+        if self.waiting:
+            self.overlaps += 1
+        self.plays += 1
+        self.playing = True
+        self.events.watch(self.player)
+        self.player.play()
+        self.settle_in = self.rng.choice((0, 1, 2, 3, 5, None))
+        self.waiting = True
+
+    def stop(self):
+        self.playing = False
+        self.waiting = False
+        self.settle_in = None
+        self.player.stop()
+        self.controller.started()
+
+    def tick(self):
+        if self.settle_in is not None:
+            if self.settle_in == 0:
+                self.player.event_manager().fire(stub_vlc.EventType.MediaPlayerPlaying)
+            self.settle_in -= 1
+        if self.waiting and self.events.settled.is_set():
+            self.waiting = False
+            self.controller.started()
+
+
+class TestPlayController(unittest.TestCase):
+
+    def test_toggle_bursts(self):
+        # bursts of presses while songs are starting: the outcome always follows the number of presses
+        for seed in range(RUNS):
+            rng = random.Random(seed)
+            app = StubApp(rng)
+            presses = 0
+            for _ in range(TICKS):
+                for _ in range(rng.choice((0, 0, 0, 1, 1, 2, 5))):
+                    app.controller.toggle()
+                    presses += 1
+                app.tick()
+            for _ in range(10):
+                app.tick()
+            self.assertEqual(app.playing, presses % 2 == 1, f'seed {seed}')
+            self.assertEqual(app.player.playing, app.playing, f'seed {seed}')
+            self.assertEqual(app.overlaps, 0, f'seed {seed}')
+            self.assertGreater(app.plays, 0)
+
+    def test_stop_never_started(self):
+        # vlc never reports the song playing, a stop still goes through straight away
+        app = StubApp(random.Random(0))
+        app.rng.choice = lambda _: None
+        app.controller.toggle()
+        for _ in range(100):
+            app.tick()
+        self.assertTrue(app.playing)
+        app.controller.toggle()
+        self.assertFalse(app.playing)
+        self.assertFalse(app.player.playing)
+        app.controller.toggle()
+        self.assertTrue(app.playing)
+        self.assertEqual(app.plays, 2)
+
+    def test_press_per_tick(self):
+        # every press acts on the tick it came in, the start of a song never holds one back
+        app = StubApp(random.Random(1))
+        for presses in range(1, 2001):
+            app.controller.toggle()
+            self.assertEqual(app.playing, presses % 2 == 1)
+            app.tick()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+# WinDJ - David Ragusa
+# Refer to the LICENSE file.
+
+# checks of the fuzzy search ranking, run with python -m unittest test_search
+
+import random
+import string
+import unittest
+from array import array
+from search import fuzzy_score, rank
+
+
+class TestFuzzy(unittest.TestCase):
+
+    def test_substring_beats_scattered(self):
+        self.assertGreater(fuzzy_score('ab', 'xab'), fuzzy_score('ab', 'a b'))
+        # word starts and runs after punctuation give a scattered match the most it can get per character
+        self.assertGreater(fuzzy_score('ab-c', 'xab-c'), fuzzy_score('ab-c', 'a b-c'))
+
+    def test_substring_ranked_first(self):
+        keys = ['a b', 'a-b', 'xab', 'axb']
+        self.assertEqual(list(rank('ab', keys, array('I', range(len(keys))))[:1]), [2])
+
+    def test_random_keys(self):
+        # any key containing the query outranks any that only matches it scattered
+        rng = random.Random(0)
+        alphabet = string.ascii_lowercase[:4] + ' -'
+        for _ in range(2000):
+            query = ''.join(rng.choices(alphabet, k=rng.randint(1, 6)))
+            keys = [''.join(rng.choices(alphabet, k=rng.randint(1, 12))) for _ in range(20)]
+            scores = [(query in key, fuzzy_score(query, key)) for key in keys]
+            exact = [score for contains, score in scores if contains]
+            scattered = [score for contains, score in scores if not contains and score is not None]
+            if exact and scattered:
+                self.assertGreater(min(exact), max(scattered), query)
+
+    def test_no_match(self):
+        self.assertIsNone(fuzzy_score('abc', 'xyz'))
+        self.assertIsNone(fuzzy_score('abc', 'ab'))  # too short a query for a typo
+
+
+if __name__ == '__main__':
+    unittest.main()
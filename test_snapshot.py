@@ -0,0 +1,103 @@
+# WinDJ - David Ragusa
+# Refer to the LICENSE file.
+
+# round trips of song lists through the snapshot file format, run with python -m unittest test_snapshot
+
+import os
+import tempfile
+import unittest
+import snapshot
+from library import SongList
+
+# a lone surrogate, as os.listdir gives for a filename that isn't valid utf-16 on windows
+NAMES = ['Intro', 'Beyoncé - Halo', 'Sigur Rós - Hoppípolla', '日本語の歌', 'broken \udc80 name', 'Intro (remix)', '']
+
+
+def song_list(names=NAMES):
+    songs = SongList()
+    root = songs.folder_id('C:\\Music', (0, ()))
+    deep = songs.folder_id('C:\\Music\\Á\\B', (0, ('Á', 'B')))
+    other = songs.folder_id('D:\\Sets', (1, ()))
+    for index, name in enumerate(names):
+        songs.append((root, deep, other)[index % 3], name + '.mp3', name)
+    return songs
+
+
+class TestSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory(ignore_cleanup_errors=True)  # windows can't delete mapped files
+        self.base = os.path.join(self.folder.name, 'library.snapshot')
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def round_trip(self, songs, key='key'):
+        _, path, sequence = snapshot.open_latest(self.base, key)
+        snapshot.write(path, key, sequence, snapshot.sections(songs))
+        read, _, _ = snapshot.open_latest(self.base, key)
+        return read
+
+    def test_round_trip(self):
+        songs = song_list()
+        read = self.round_trip(songs)
+        self.assertEqual(len(read), len(songs))
+        self.assertEqual(read.folders, songs.folders)
+        self.assertEqual(read.folder_keys, songs.folder_keys)
+        self.assertEqual(list(read.folder_ids), list(songs.folder_ids))
+        self.assertEqual(list(read.filenames), songs.filenames)
+        self.assertEqual(list(read.displays), songs.displays)
+        self.assertEqual(list(read.search_keys), songs.search_keys)
+        for index in range(len(songs)):
+            self.assertEqual(read[index]['path'], songs[index]['path'])
+            self.assertEqual(read.displays[index], songs.displays[index])
+        self.assertEqual(read.displays[-1], '')
+        with self.assertRaises(IndexError):
+            read.displays[len(songs)]
+        self.assertTrue(snapshot.unchanged(read, songs))
+
+    def test_empty(self):
+        read = self.round_trip(SongList())
+        self.assertEqual(len(read), 0)
+        self.assertEqual(list(read.search_keys.containing('a')), [])
+
+    def test_containing(self):
+        songs = song_list()
+        read = self.round_trip(songs)
+        for text in ('intro', 'o', 'halo', 'ros', '日本', '\udc80', 'mix)', 'zzz', ''):
+            expected = [index for index, key in enumerate(songs.search_keys) if text in key]
+            self.assertEqual(list(read.search_keys.containing(text)), expected, text)
+        # matches only ever start in the string they're found in, never run on into the next one
+        self.assertEqual(list(read.search_keys.containing('introbey')), [])
+
+    def test_unchanged(self):
+        read = self.round_trip(song_list())
+        self.assertFalse(snapshot.unchanged(read, song_list(NAMES[:-1])))
+        renamed = song_list()
+        renamed.displays[1] = 'Beyonce - Halo'
+        self.assertFalse(snapshot.unchanged(read, renamed))
+        moved = song_list()
+        moved.folder_ids[0] = 2
+        self.assertFalse(snapshot.unchanged(read, moved))
+
+    def test_alternates(self):
+        # the newest of the two files is read, the next one goes to the other
+        self.round_trip(song_list(['first']))
+        read = self.round_trip(song_list(['second']))
+        self.assertEqual(list(read.displays), ['second'])
+        _, path, sequence = snapshot.open_latest(self.base, 'key')
+        self.assertEqual((path, sequence), (self.base + '.0', 3))
+
+    def test_unusable(self):
+        self.round_trip(song_list())
+        self.assertIsNone(snapshot.open_latest(self.base, 'other folders')[0])
+        with open(self.base + '.0', 'r+b') as file:
+            file.truncate(os.path.getsize(self.base + '.0') - 4)
+        self.assertIsNone(snapshot.open_latest(self.base, 'key')[0])
+        with open(self.base + '.0', 'wb') as file:
+            file.write(b'not a snapshot')
+        self.assertIsNone(snapshot.open_latest(self.base, 'key')[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
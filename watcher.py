@@ -0,0 +1,170 @@
+# WinDJ - David Ragusa
+# Refer to the LICENSE file.
+
+import os
+import sys
+import queue
+import select
+import struct
+import ctypes
+import ctypes.util
+import threading
+from library import list_dir
+
+# inotify event masks, see inotify(7)
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_NONBLOCK = 0o4000
+WATCH_MASK = IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+EVENT = struct.Struct('iIII')
+
+
+class Inotify:
+    # minimal ctypes wrapper around the linux inotify api - one watch per folder
+
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.watches = {}  # wd -> path
+        self.paths = {}  # path -> wd
+
+    def add(self, path):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd >= 0:
+            self.watches[wd] = path
+            self.paths[path] = wd
+
+    def read(self, timeout):
+        # returns the folders that changed, or None if the kernel queue overflowed
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return set()
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+        dirty = set()
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT.unpack_from(data, offset)
+            offset += EVENT.size + length
+            if mask & IN_Q_OVERFLOW:
+                return None
+            if mask & IN_IGNORED:
+                # folder deleted or watch removed
+                path = self.watches.pop(wd, None)
+                self.paths.pop(path, None)
+            elif wd in self.watches:
+                dirty.add(self.watches[wd])
+        return dirty
+
+
+class FolderWatcher(threading.Thread):
+    # watches the library folders from a background thread and posts batches of relisted folders
+    # to self.results as (path, parent, mtime, files, subdirs) - files is None for a vanished folder
+
+    def __init__(self, excludes, depth, interval):
+        super().__init__(daemon=True)
+        self.excludes = excludes
+        self.depth = depth
+        self.interval = interval
+        self.results = queue.Queue()
+        self.lock = threading.Lock()
+        self.known = {}  # path -> (parent, depth, mtime)
+        self.resync = False
+        self.inotify = None
+        if sys.platform.startswith('linux'):
+            try:
+                self.inotify = Inotify()
+            except (OSError, AttributeError):
+                pass  # fall back to polling
+
+    def watch(self, folders):
+        # called from the UI thread with the library's current {path: (parent, depth, mtime)}
+        with self.lock:
+            self.known = dict(folders)
+            self.resync = True
+
+    def run(self):
+        while True:
+            dirty = self.wait_for_changes()
+            if dirty:
+                self.results.put(self.relist(dirty))
+
+    def wait_for_changes(self):
+        with self.lock:
+            if self.resync and self.inotify:
+                # deleted folders drop their own watches (IN_IGNORED), so watches are only ever added here
+                for path in set(self.known) - set(self.inotify.paths):
+                    self.inotify.add(path)
+            self.resync = False
+            known = dict(self.known)
+
+        if self.inotify:
+            dirty = self.inotify.read(self.interval)
+            if dirty is None:
+                return self.poll(known)
+            # let a burst of events (e.g. a folder being copied in) settle into one batch
+            while dirty:
+                more = self.inotify.read(0.25)
+                if more is None:
+                    return self.poll(known)
+                if not more:
+                    break
+                dirty |= more
+            return dirty
+        else:
+            threading.Event().wait(self.interval)
+            return self.poll(known)
+
+    def poll(self, known):
+        dirty = set()
+        for path, (_, _, mtime) in known.items():
+            try:
+                if os.stat(path).st_mtime_ns != mtime:
+                    dirty.add(path)
+            except OSError:
+                dirty.add(path)
+        return dirty
+
+    def relist(self, dirty):
+        results = []
+        with self.lock:
+            known = dict(self.known)
+        stack = [(path, *known[path][:2]) for path in dirty if path in known]
+        real_paths = None  # of the folders known, only worked out if there are new ones
+        while stack:
+            path, parent, depth = stack.pop()
+            if self.inotify and path not in known:
+                # watch before listing so nothing created in between is missed
+                self.inotify.add(path)
+            try:
+                mtime = os.stat(path).st_mtime_ns
+                files, subdirs, _ = list_dir(path, self.excludes)
+            except OSError:
+                results.append((path, parent, None, None, None))
+                continue
+            results.append((path, parent, mtime, files, subdirs))
+            if self.depth is None or depth < self.depth:
+                # brand new subfolders have to be listed as well, unless they're links to a folder already known
+                for subdir in subdirs:
+                    if subdir in known:
+                        continue
+                    if real_paths is None:
+                        real_paths = {os.path.realpath(known_path) for known_path in known}
+                    real = os.path.realpath(subdir)
+                    if real not in real_paths:
+                        real_paths.add(real)
+                        stack.append((subdir, path, depth + 1))
+            with self.lock:
+                if path in self.known:
+                    self.known[path] = (parent, depth, mtime)
+        return results
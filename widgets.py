@@ -0,0 +1,114 @@
+# WinDJ - David Ragusa
+# Refer to the LICENSE file.
+
+import tkinter as tk
+from tkinter import font
+
+
+class VirtualList(tk.Frame):
+    # listbox that only ever holds the rows on screen, however long the list of items is
+    # rows and the selection are tracked by logical index; the scrollbar is sized to the whole list
+
+    def __init__(self, master, click=None, double_click=None):
+        super().__init__(master)
+        self.items = []
+        self.top = 0  # logical index of the first row on screen
+        self.selection = 0
+        self.rows = 1  # rows fully on screen
+        self.row_height = font.Font(font='TkDefaultFont').metrics('linespace') + 1
+
+        self.scrollbar = tk.Scrollbar(self, command=self.scroll)
+        self.scrollbar.grid(row=0, column=0, sticky=(tk.N, tk.S))
+        self.listbox = tk.Listbox(self, selectmode=tk.BROWSE, exportselection=False)
+        self.listbox.grid(row=0, column=1, sticky=(tk.N, tk.S, tk.W, tk.E))
+        self.rowconfigure(0, weight=1)
+        self.columnconfigure(1, weight=1)
+
+        # the listbox never scrolls itself, all scrolling goes through self.top
+        self.listbox.bind('<Up> <Down> <Left> <Right> <Next> <Prior>', lambda _: 'break')
+        self.listbox.bind('<B1-Motion>', lambda _: 'break')
+        self.listbox.bind('<MouseWheel>', lambda event: self.scroll('scroll', -event.delta // 40, 'units'))
+        self.listbox.bind('<Button-4>', lambda _: self.scroll('scroll', -3, 'units'))
+        self.listbox.bind('<Button-5>', lambda _: self.scroll('scroll', 3, 'units'))
+        self.listbox.bind('<Configure>', self.resize)
+        if click:
+            self.listbox.bind('<Button-1>', click)
+        if double_click:
+            self.listbox.bind('<Double-Button-1>', double_click)
+
+    def size(self):
+        return len(self.items)
+
+    def focus_set(self):
+        self.listbox.focus_set()
+
+    def nearest(self, y):
+        return min(self.top + self.listbox.nearest(y), max(0, len(self.items) - 1))
+
+    def set_items(self, items):
+        # items need len() and item[index]['display']
+        self.items = items
+        self.top = 0
+        self.selection = 0
+        self.render()
+
+    def refresh(self):
+        # the items changed in place
+        self.top = max(0, min(self.top, len(self.items) - self.rows))
+        self.selection = max(0, min(self.selection, len(self.items) - 1))
+        self.render()
+
+    def select(self, index):
+        index = max(0, min(index, len(self.items) - 1))
+        self.selection = index
+        if index < self.top:
+            self.top = index
+        elif index >= self.top + self.rows:
+            self.top = index - self.rows + 1
+        else:
+            self.highlight()
+            return
+        self.render()
+
+    def scroll(self, *args):
+        # scrollbar command, mouse wheel
+        if args[0] == 'moveto':
+            top = round(float(args[1]) * len(self.items))
+        elif args[2] == 'pages':
+            top = self.top + int(args[1]) * self.rows
+        else:
+            top = self.top + int(args[1])
+        top = max(0, min(top, len(self.items) - self.rows))
+        if top != self.top:
+            self.top = top
+            self.render()
+        return 'break'
+
+    def resize(self, event):
+        first, second = self.listbox.bbox(0), self.listbox.bbox(1)
+        if first and second:
+            # measure the real row height, including any selection border
+            self.row_height = second[1] - first[1] or self.row_height
+        rows = max(1, event.height // self.row_height)
+        if rows != self.rows:
+            self.rows = rows
+            self.top = max(0, min(self.top, len(self.items) - self.rows))
+            self.render()
+
+    def render(self):
+        # one extra row so a partly visible last row isn't left blank
+        end = min(self.top + self.rows + 1, len(self.items))
+        self.listbox.delete(0, tk.END)
+        if end > self.top:
+            self.listbox.insert(tk.END, *(self.items[index]['display'] for index in range(self.top, end)))
+        self.highlight()
+        if self.items:
+            self.scrollbar.set(self.top / len(self.items), min(1.0, (self.top + self.rows) / len(self.items)))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+
+    def highlight(self):
+        self.listbox.selection_clear(0, tk.END)
+        if self.top <= self.selection <= self.top + self.rows:
+            self.listbox.selection_set(self.selection - self.top)
+            self.listbox.activate(self.selection - self.top)